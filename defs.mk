@@ -23,6 +23,8 @@ uniprotProteinTranscriptMap = ${binDir}/uniprotProteinTranscriptMap
 uniprotAnnotsMap = ${binDir}/uniprotAnnotsMap
 uniprotAnnotsToDecorators = ${binDir}/uniprotAnnotsToDecorators
 uniprotDecoratorsMerge = ${binDir}/uniprotDecoratorsMerge
+uniprotMapServer = ${binDir}/uniprotMapServer
+uniprotMapQuery = ${binDir}/uniprotMapQuery
 xspeciesTrans2GenomeMap = ${binDir}/xspeciesTrans2GenomeMap
 xspeciesTrans2TransMap = ${binDir}/xspeciesTrans2TransMap
 xspeciesGencode2CatFilter = ${binDir}/xspeciesGencode2CatFilter
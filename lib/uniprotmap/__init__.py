@@ -5,7 +5,6 @@ Library of common functions and other definitions
 import sys
 import os
 from pycbio import NoStackError
-from pycbio.sys import fileOps
 
 class OutOfSyncError(Exception):
     "error when files that should be matched are out-of-sync"
@@ -57,6 +56,7 @@ class TmpOrSaveFile(str):
     or discarded once used internally and then deleted"""
     def __new__(cls, interPrefix, suffix):
         if interPrefix is None:
+            from pycbio.sys import fileOps
             path = fileOps.tmpFileGet(suffix=suffix)
         else:
             path = interPrefix + suffix
@@ -5,11 +5,11 @@ from os import path as osp
 import re
 import glob
 import pipettor
-from pycbio.distrib.parasol import Para
 from pycbio.sys import fileOps
 from pycbio.hgdata.psl import PslReader
-from Bio import SeqIO
 from uniprotmap import conf, prMsg
+from uniprotmap.progress import progressIter
+from uniprotmap.compressedFiles import compressedOpen
 from uniprotmap.depends import runIfNotDone, runIfOutOfDate, getDoneFile
 
 DEFAULT_QUERY_SPLIT_APPROX_SIZE = 25000
@@ -54,6 +54,7 @@ def _runBatch(alignCmdPre, queriesDir, targetDbFa, alignDir, alignBatchDir):
     "alignCmdPre is list of program and initial arguments"
     fileOps.ensureDir(alignBatchDir)
     jobFile = _makeJobFile(alignCmdPre, queriesDir, targetDbFa, alignDir, alignBatchDir)
+    from pycbio.distrib.parasol import Para
     para = Para(paraHost=conf.paraHost, jobFile=jobFile, paraDir=alignBatchDir)
     para.clearSickNodes()
     para.freeBatch()
@@ -73,6 +74,7 @@ def _queryListSplitFas(queriesDir):
     return sorted(glob.glob(_queryGetSplitPrefix(queriesDir) + "*"))
 
 def _queryFilterEditFasta(inFaFh, outFaFh, filterEditFunc):
+    from Bio import SeqIO
     for faRec in SeqIO.parse(inFaFh, "fasta"):
         if (filterEditFunc is None) or filterEditFunc(faRec):
             SeqIO.write(faRec, outFaFh, "fasta")
@@ -102,6 +104,7 @@ def _targetMakeUtrMaskedFasta(inFa, outFa, filterEditFunc):
     """
     Create FASTA with lower-case UTR hard-masked
     """
+    from Bio import SeqIO
     with fileOps.opengz(inFa) as inFh:
         with fileOps.opengz(outFa, 'w') as outFh:
             for rec in SeqIO.parse(inFh, "fasta"):
@@ -124,7 +127,7 @@ def _queryTargetPairPslReader(inPslFh):
     be sorted by (target, query)."""
     # Batch program has already discards PSLs that are not ++ alignments,
     pairedPsls = []
-    for psl in PslReader(inPslFh):
+    for psl in progressIter(PslReader(inPslFh), "combining alignments", unit="PSLs"):
         if len(pairedPsls) == 0:
             pairedPsls.append(psl)
         elif ((psl.qName == pairedPsls[0].qName) and
@@ -157,7 +160,7 @@ def _combinePairAligns(alignDir, prot2TransPslFile, filterFunc):
     findSortCmd = (["find", alignDir, "-name", "*.fa.psl", "-print0"],
                    ["sort", "-k14,14", "-k10,10", "--files0-from=-"])
     with pipettor.Popen(findSortCmd, 'r') as inPslFh:
-        with fileOps.opengz(prot2TransPslFile, 'w') as outPslFh:
+        with compressedOpen(prot2TransPslFile, 'w') as outPslFh:
             _processAlignedPsls(inPslFh, outPslFh, filterFunc)
 
 ##
@@ -165,28 +168,35 @@ def _combinePairAligns(alignDir, prot2TransPslFile, filterFunc):
 ##
 def proteinTranscriptAlign(protFa, transFa, prot2TransPslFile, algo, workDir, *,
                            queryFaEditFilterFunc=None, targetFaEditFilterFunc=None, alignFilterFunc=None,
-                           querySplitSize=DEFAULT_QUERY_SPLIT_APPROX_SIZE):
+                           querySplitSize=DEFAULT_QUERY_SPLIT_APPROX_SIZE, byContent=False):
+    """If byContent is True, steps are only rerun if the content of inputs or
+    parameters change, not modification times.  Changes to the filter
+    functions are not detected."""
     targetDir = osp.join(workDir, "transDb")
     transDbFa = osp.join(targetDir, "transDb.fa")
-    with runIfNotDone(targetDir, depends=transFa) as do:
+    with runIfNotDone(targetDir, depends=transFa,
+                      byContent=byContent, params={"algo": algo}) as do:
         if do:
             prMsg("building target transcript database")
             _targetBuildDb(transFa, transDbFa, algo, targetFaEditFilterFunc, targetDir)
 
     queryDir = osp.join(workDir, "queryDir")
-    with runIfNotDone(queryDir, depends=protFa) as do:
+    with runIfNotDone(queryDir, depends=protFa,
+                      byContent=byContent, params={"querySplitSize": querySplitSize}) as do:
         if do:
             prMsg("split proteins")
             _queryBuildDb(protFa, queryDir, queryFaEditFilterFunc, querySplitSize)
 
     alignDir = osp.join(workDir, "aligns")
-    with runIfNotDone(alignDir, doneDepends=[targetDir, queryDir]) as do:
+    with runIfNotDone(alignDir, doneDepends=[targetDir, queryDir],
+                      byContent=byContent, params={"algo": algo}) as do:
         if do:
             prMsg("running alignment batch")
             _runBatch([proteinTranscriptAlignJob, algo], queryDir, transDbFa, alignDir,
                       osp.join(workDir, "batch"))
 
-    with runIfOutOfDate(prot2TransPslFile, doneDepends=alignDir) as do:
+    with runIfOutOfDate(prot2TransPslFile, doneDepends=alignDir,
+                        byContent=byContent) as do:
         if do:
             prMsg("combining alignments")
             with fileOps.AtomicFileCreate(prot2TransPslFile) as tmpPslFile:
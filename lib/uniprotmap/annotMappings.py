@@ -1,10 +1,13 @@
 """
 Annotation mappings data for analysis
 """
+from array import array
 from collections import namedtuple, defaultdict
-from pycbio.hgdata.psl import PslReader
+from pycbio.hgdata.psl import Psl
 from pycbio.hgdata.coords import Coords
 from uniprotmap.metadata import annot2GenomeRefReader
+from uniprotmap.progress import progressIter
+from uniprotmap.compressedFiles import compressedPslReader, isCompressedFileName
 
 
 class MappingError(Exception):
@@ -130,8 +133,38 @@ def _transAnnot2GenomeRefReader(annot2GenomeRefTsv):
     if len(transAnnot2GenomeRefs) > 0:
         yield transAnnot2GenomeRefs
 
+class PslLineIndex:
+    """Random access to the PSLs in an uncompressed file by zero-based line
+    number.  Only the offsets of the lines are kept in memory, with PSLs
+    parsed when accessed."""
+    def __init__(self, pslFile):
+        self.fh = open(pslFile, 'rb')
+        self.offsets = array('q')
+        offset = 0
+        for line in progressIter(self.fh, f"indexing {pslFile}", unit="PSLs"):
+            self.offsets.append(offset)
+            offset += len(line)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, idx):
+        self.fh.seek(self.offsets[idx])
+        return Psl.fromRow(self.fh.readline().decode().rstrip('\n').split('\t'))
+
+    def close(self):
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
+
+def _loadAnnot2GenomePsls(annot2GenomePslFile, indexPsls):
+    if indexPsls and not isCompressedFileName(annot2GenomePslFile):
+        return PslLineIndex(annot2GenomePslFile)
+    else:
+        return [p for p in progressIter(compressedPslReader(annot2GenomePslFile), f"reading {annot2GenomePslFile}", unit="PSLs")]
+
 def transAnnotMappingReader(annot2GenomePslFile, annot2GenomeRefTsv, annotLookupFunc,
-                            transPslLookupFunc, *, inTranscriptionOrder=False):
+                            transPslLookupFunc, *, inTranscriptionOrder=False, indexPsls=False):
     """
     Reads mapped annotation alignments and metadata for target transcripts, including
     those that did not align successfully. Yields TransAnnotMapping objects.
@@ -145,14 +178,21 @@ def transAnnotMappingReader(annot2GenomePslFile, annot2GenomeRefTsv, annotLookup
             and returns the corresponding alignment information.
         sortByCoords: If True. then sort by coordinates.  Can not be used on spared mapped
             annotations.
+        indexPsls: If True, PSLs are read from the file as needed rather than all loaded
+            into memory.  Ignored for compressed files.
     Yields:
         TransAnnotMapping objects, one for each annotation.
     """
 
-    annot2GenomePsls = [p for p in PslReader(annot2GenomePslFile)]
-    for transAnnot2GenomeRefs in _transAnnot2GenomeRefReader(annot2GenomeRefTsv):
-        yield _makeTransAnnotMapping(transAnnot2GenomeRefs, annot2GenomePsls, annotLookupFunc, transPslLookupFunc,
-                                     inTranscriptionOrder)
+    annot2GenomePsls = _loadAnnot2GenomePsls(annot2GenomePslFile, indexPsls)
+    try:
+        for transAnnot2GenomeRefs in progressIter(_transAnnot2GenomeRefReader(annot2GenomeRefTsv),
+                                                  "transAnnotMappingReader", unit="transcripts"):
+            yield _makeTransAnnotMapping(transAnnot2GenomeRefs, annot2GenomePsls, annotLookupFunc, transPslLookupFunc,
+                                         inTranscriptionOrder)
+    finally:
+        if isinstance(annot2GenomePsls, PslLineIndex):
+            annot2GenomePsls.close()
 
 
 def transAnnotMappingLoader(annot2GenomePslFile, annot2GenomeRefTsv, annotLookupFunc,
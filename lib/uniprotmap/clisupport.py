@@ -1,12 +1,13 @@
 """
 Common CLI parsing functions.
 """
-from uniprotmap.geneset import GeneSetName
+from contextlib import contextmanager
 
 def cliAddGeneSetParameters(parser, *, inclMetadata=False, inclTransGenomePsl=False,
                             inclTransGenomeGp=False, inclTransFa=False):
     """add the requested position parameters to a parser. A geneSet name is
     always required."""
+    from uniprotmap.geneset import GeneSetName
     parser.add_argument("geneSetName", type=GeneSetName, choices=GeneSetName,
                         help="""name of gene set""")
     if inclMetadata:
@@ -21,3 +22,31 @@ def cliAddGeneSetParameters(parser, *, inclMetadata=False, inclTransGenomePsl=Fa
     if inclTransFa:
         parser.add_argument("transFa",
                             help="""Transcript FASTA file. (input)""")
+
+def cliAddGeneSetCacheOption(parser):
+    """add the --geneSetCacheDir option"""
+    parser.add_argument("--geneSetCacheDir",
+                        help="""cache loaded gene sets in this directory; entries are keyed by the content of the input files""")
+
+def cliAddInstrumentOptions(parser):
+    """add the --profile, --timings and progress reporting options"""
+    parser.add_argument("--profile",
+                        help="""profile the program, including worker processes, with cProfile and write the statistics to this file""")
+    parser.add_argument("--timings",
+                        help="""write wall time, CPU time, record counts and memory usage for each stage of the program to this JSON file""")
+    parser.add_argument("--progress", action="store_true",
+                        help="""periodically report records processed, rate, estimated time remaining and memory usage of long running steps to stderr""")
+    parser.add_argument("--progressJson",
+                        help="""write progress reports as JSON lines to this file""")
+    parser.add_argument("--progressInterval", type=float, default=30.0,
+                        help="""seconds between progress reports""")
+
+@contextmanager
+def cliInstrument(opts):
+    """context manager to instrument a program as specified by the options
+    added by cliAddInstrumentOptions"""
+    from uniprotmap.instrument import Instrumentation
+    from uniprotmap.progress import ProgressReporting
+    with Instrumentation(opts.profile, opts.timings):
+        with ProgressReporting(opts.progressInterval, toStderr=opts.progress, jsonFile=opts.progressJson):
+            yield
@@ -0,0 +1,342 @@
+"""
+Compressed file I/O that does the compression work in background threads,
+for large PSL, TSV and BED files.  zlib and zstd release the GIL, so the
+compression overlaps with the program producing or parsing the records.
+
+Output is compressed based on the file extension: .gz and .bgz files are
+written in BGZF format, with blocks compressed in parallel by a thread
+pool.  BGZF is a series of gzip members, so it can be read by any gzip
+reader and indexed by htslib tools.  .zst files are compressed with
+multi-threaded zstd, which requires the zstandard package.  Other types of
+compressed files are handled by fileOps.opengz.  Other files are not compressed.
+Files that are read by the Kent programs, such as pslMap, must use .gz, as
+they do not read zstd.
+
+Input compression is detected from the file contents.  gzip files are
+decompressed by a read-ahead thread, with BGZF blocks decompressed in
+parallel.  compressedPslReader() and compressedTsvReader() read PSL and TSV
+files this way.
+"""
+import io
+import os
+import zlib
+import gzip
+import queue
+import struct
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pycbio.sys import fileOps
+from pycbio.sys.symEnum import SymEnum, auto
+from pycbio.hgdata.psl import PslReader
+from pycbio.tsv import TsvReader
+
+class CompressedFileError(Exception):
+    pass
+
+class CompressType(SymEnum):
+    none = auto()
+    bgzf = auto()
+    zstd = auto()
+
+_compressExts = {".gz": CompressType.bgzf,
+                 ".bgz": CompressType.bgzf,
+                 ".zst": CompressType.zstd}
+
+# compressed with an external program by fileOps.opengz
+_opengzExts = frozenset([".bz2", ".xz", ".Z"])
+
+# default number of compression threads
+compressThreadsDefault = min(os.cpu_count() or 1, 8)
+
+# default compression levels, those of gzip and zstd
+_defaultLevels = {CompressType.bgzf: 6,
+                  CompressType.zstd: 3}
+
+_gzipMagic = b'\x1f\x8b'
+_zstdMagic = b'\x28\xb5\x2f\xfd'
+
+# size of buffers for reads and writes
+_ioBufferSize = 1024 * 1024
+
+def compressTypeFromName(fileName):
+    "compression type based on a file's extension"
+    return _compressExts.get(os.path.splitext(fileName)[1], CompressType.none)
+
+def isCompressedFileName(fileName):
+    return (compressTypeFromName(fileName) != CompressType.none) or (os.path.splitext(fileName)[1] in _opengzExts)
+
+def _importZstandard():
+    try:
+        import zstandard
+    except ImportError as ex:
+        raise CompressedFileError("zstd compression requires the zstandard Python package") from ex
+    return zstandard
+
+###
+# BGZF writing
+###
+# maximum uncompressed size of a block, the same as bgzip, which ensures
+# the compressed block fits in 64kb
+_bgzfBlockInputSize = 65280
+_bgzfMaxBlockSize = 65536
+_bgzfHeaderSize = 18
+_bgzfTrailerSize = 8
+
+# empty block that marks the end of a BGZF file
+_bgzfEofBlock = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+def _bgzfDeflate(data, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush()
+
+def _bgzfBlock(data, level):
+    "compress a BGZF block, called in the thread pool"
+    deflated = _bgzfDeflate(data, level)
+    if len(deflated) + _bgzfHeaderSize + _bgzfTrailerSize > _bgzfMaxBlockSize:
+        deflated = _bgzfDeflate(data, 0)  # incompressible data
+    blockSize = len(deflated) + _bgzfHeaderSize + _bgzfTrailerSize
+    return b''.join((struct.pack("<4BI2BH2BHH", 0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, ord('B'), ord('C'), 2, blockSize - 1),
+                     deflated,
+                     struct.pack("<II", zlib.crc32(data), len(data))))
+
+class _BgzfRawWriter(io.RawIOBase):
+    """Write BGZF blocks compressed by a thread pool.  Blocks are written in
+    order, with the number waiting limited to bound memory usage."""
+    def __init__(self, fh, threads, level):
+        self.fh = fh
+        self.level = level
+        self.pool = ThreadPoolExecutor(threads, thread_name_prefix="bgzf")
+        self.maxPending = 4 * threads
+        self.pending = deque()
+        self.buf = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buf += data
+        while len(self.buf) >= _bgzfBlockInputSize:
+            self._submit(bytes(self.buf[0:_bgzfBlockInputSize]))
+            del self.buf[0:_bgzfBlockInputSize]
+        return len(data)
+
+    def _submit(self, block):
+        self.pending.append(self.pool.submit(_bgzfBlock, block, self.level))
+        while len(self.pending) > self.maxPending:
+            self.fh.write(self.pending.popleft().result())
+
+    def _drain(self):
+        while len(self.pending) > 0:
+            self.fh.write(self.pending.popleft().result())
+
+    def close(self):
+        if not self.closed:
+            try:
+                if len(self.buf) > 0:
+                    self._submit(bytes(self.buf))
+                self._drain()
+                self.fh.write(_bgzfEofBlock)
+            finally:
+                self.pool.shutdown(cancel_futures=True)
+                self.fh.close()
+                super().close()
+
+class _ZstdRawWriter(io.RawIOBase):
+    "write with zstandard's multi-threaded compressor"
+    def __init__(self, fh, threads, level):
+        zstandard = _importZstandard()
+        self.fh = fh
+        self.writer = zstandard.ZstdCompressor(level=level, threads=threads).stream_writer(fh, closefd=False)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.writer.write(data)
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            try:
+                self.writer.close()
+            finally:
+                self.fh.close()
+                super().close()
+
+def _openWrite(fileName, compressType, threads, level):
+    fh = open(fileName, 'wb')
+    if compressType == CompressType.none:
+        return fh
+    try:
+        if compressType == CompressType.bgzf:
+            raw = _BgzfRawWriter(fh, threads, level)
+        else:
+            raw = _ZstdRawWriter(fh, threads, level)
+    except BaseException:
+        fh.close()
+        raise
+    return io.BufferedWriter(raw, _ioBufferSize)
+
+###
+# reading
+###
+class _ReadAheadRawReader(io.RawIOBase):
+    """Reads chunks produced by a generator function run in a background
+    thread, passing them through a bounded queue.  An exception in the thread
+    is re-raised in the reader."""
+    _END = object()
+
+    def __init__(self, fileName, chunkGen, *, maxChunks=16):
+        self.fileName = fileName
+        self.chunks = queue.Queue(maxChunks)
+        self.chunk = memoryview(b'')
+        self.eof = False
+        self.stopping = False
+        self.thread = threading.Thread(target=self._produce, args=(chunkGen,), name="readAhead", daemon=True)
+        self.thread.start()
+
+    def _produce(self, chunkGen):
+        try:
+            for chunk in chunkGen:
+                if self.stopping:
+                    return
+                self.chunks.put(chunk)
+            self.chunks.put(self._END)
+        except Exception as ex:
+            self.chunks.put(ex)
+        finally:
+            chunkGen.close()
+
+    def readable(self):
+        return True
+
+    def _nextChunk(self):
+        chunk = self.chunks.get()
+        if chunk is self._END:
+            self.eof = True
+        elif isinstance(chunk, Exception):
+            self.eof = True
+            raise CompressedFileError(f"read failed: {self.fileName}") from chunk
+        else:
+            self.chunk = memoryview(chunk)
+
+    def readinto(self, buf):
+        while (len(self.chunk) == 0) and not self.eof:
+            self._nextChunk()
+        cnt = min(len(buf), len(self.chunk))
+        buf[0:cnt] = self.chunk[0:cnt]
+        self.chunk = self.chunk[cnt:]
+        return cnt
+
+    def close(self):
+        "stop thread if not all read; the queue is drained so it does not block"
+        if not self.closed:
+            self.stopping = True
+            while self.thread.is_alive():
+                try:
+                    self.chunks.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            self.thread.join()
+            super().close()
+
+def _isBgzf(header):
+    "gzip header with only the BGZF extra field"
+    return ((len(header) >= _bgzfHeaderSize) and (header[0:4] == b'\x1f\x8b\x08\x04')
+            and (header[10:16] == b'\x06\x00BC\x02\x00'))
+
+def _bgzfBlockReader(fileName, fh):
+    "generate compressed BGZF blocks"
+    while True:
+        header = fh.read(_bgzfHeaderSize)
+        if len(header) == 0:
+            break
+        if not _isBgzf(header):
+            raise CompressedFileError(f"invalid or mixed BGZF block: {fileName}")
+        blockSize = struct.unpack("<H", header[16:18])[0] + 1
+        rest = fh.read(blockSize - _bgzfHeaderSize)
+        if len(rest) != blockSize - _bgzfHeaderSize:
+            raise CompressedFileError(f"truncated BGZF file: {fileName}")
+        yield header + rest
+
+def _bgzfInflate(block):
+    "decompress a BGZF block, checking the CRC, called in the thread pool"
+    return zlib.decompress(block, 31)
+
+def _bgzfChunkGen(fileName, fh, threads):
+    "decompress blocks in parallel, in order, yielding uncompressed data"
+    with fh, ThreadPoolExecutor(threads, thread_name_prefix="bgzf") as pool:
+        pending = deque()
+        for block in _bgzfBlockReader(fileName, fh):
+            pending.append(pool.submit(_bgzfInflate, block))
+            if len(pending) > 4 * threads:
+                yield pending.popleft().result()
+        while len(pending) > 0:
+            yield pending.popleft().result()
+
+def _gzipChunkGen(fh):
+    with gzip.GzipFile(fileobj=fh) as gzFh, fh:
+        while True:
+            chunk = gzFh.read(_ioBufferSize)
+            if len(chunk) == 0:
+                break
+            yield chunk
+
+def _zstdChunkGen(fh):
+    zstandard = _importZstandard()
+    with zstandard.ZstdDecompressor().stream_reader(fh, read_across_frames=True, closefd=True) as zstFh:
+        while True:
+            chunk = zstFh.read(_ioBufferSize)
+            if len(chunk) == 0:
+                break
+            yield chunk
+
+def _openRead(fileName, threads):
+    "peek rather than reopen to detect compression so pipes can be read"
+    fh = open(fileName, 'rb', buffering=_ioBufferSize)
+    header = fh.peek(_bgzfHeaderSize)
+    if header[0:2] == _gzipMagic:
+        if _isBgzf(header):
+            chunkGen = _bgzfChunkGen(fileName, fh, threads)
+        else:
+            chunkGen = _gzipChunkGen(fh)
+    elif header[0:4] == _zstdMagic:
+        chunkGen = _zstdChunkGen(fh)
+    else:
+        return fh
+    return io.BufferedReader(_ReadAheadRawReader(fileName, chunkGen), _ioBufferSize)
+
+def compressedOpen(fileName, mode='r', *, compressType=None, threads=None, level=None, encoding="utf-8"):
+    """Open a file, possibly compressed, with the compression or decompression
+    done in background threads.  For writing, compressType defaults to a type
+    based on the file name.  The mode is 'r' or 'w', with 't' or 'b'
+    optionally added; text mode is the default."""
+    if mode not in ('r', 'rt', 'rb', 'w', 'wt', 'wb'):
+        raise CompressedFileError(f"invalid mode '{mode}' opening: {fileName}")
+    if (compressType is None) and (os.path.splitext(fileName)[1] in _opengzExts):
+        return fileOps.opengz(fileName, mode)
+    if threads is None:
+        threads = compressThreadsDefault
+    if mode[0] == 'r':
+        fh = _openRead(fileName, threads)
+    else:
+        if compressType is None:
+            compressType = compressTypeFromName(fileName)
+        if level is None:
+            level = _defaultLevels.get(compressType)
+        fh = _openWrite(fileName, compressType, threads, level)
+    if mode.endswith('b'):
+        return fh
+    return io.TextIOWrapper(fh, encoding=encoding)
+
+def compressedPslReader(pslFile):
+    "generator of PSLs from a file, decompressing in background threads"
+    with compressedOpen(pslFile) as fh:
+        yield from PslReader(fh)
+
+def compressedTsvReader(tsvFile, **kwargs):
+    """generator of rows from a TSV file, decompressing in background threads,
+    kwargs are passed to TsvReader"""
+    with compressedOpen(tsvFile) as fh:
+        yield from TsvReader(tsvFile, inFh=fh, **kwargs)
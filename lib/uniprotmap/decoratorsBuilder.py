@@ -2,12 +2,36 @@
 Generate decorators using multiprocessing.  This calls an function to
 generate decorators given PSLs in each subprocess.
 """
-import multiprocessing as mp
+import os
+import hashlib
 import pipettor
 from pycbio.sys import fileOps
+from pycbio.tsv import TsvReader
+from uniprotmap.instrument import timedStage, workerProfileStart
+from uniprotmap.progress import progressTrack
+from uniprotmap.compressedFiles import compressedOpen
 
 # chrom,  chromStart, chromEnd, decoratedItem, name, dataset
-decoratorBedSortOpts = ["-k1,1", "-k2,2n", "-k3,3n", "-k13,13", "-k4,4n", "-k17,17"]
+# as (one-based column, is numeric)
+decoratorBedSortKeys = ((1, False), (2, True), (3, True), (13, False), (4, True), (17, False))
+decoratorBedSortOpts = [f"-k{col},{col}{'n' if numeric else ''}" for col, numeric in decoratorBedSortKeys]
+
+# sort in the C locale so the order matches the merge in decoratorsMerge;
+# pipettor doesn't take an environment, so this is done with env(1)
+_sortCmd = ["env", "LC_ALL=C", "sort"]
+
+# zero-based column of decoratedItem, and number of columns before the
+# extra decorator type-specific columns
+DECORATED_ITEM_COL = 12
+DECORATOR_BED_NUM_COLS = 16
+
+def decoratedItemParse(decoratedItem):
+    "parse chrom:start-end:item_name to (item_name, chrom)"
+    chrom, _, itemName = decoratedItem.rsplit(':', 2)
+    return itemName, chrom
+
+class DecoratorBuildError(Exception):
+    pass
 
 ##
 # This holds the forked process-global instance of AnnotationProcessor
@@ -25,6 +49,11 @@ def _workerInit(annotationProcessorFactory):
         _gAnnotationProcessor = Exception("Pool initialization failed")
         _gAnnotationProcessor.__cause__ = ex
 
+def _poolWorkerInit(annotationProcessorFactory):
+    "pool sub-process setup"
+    workerProfileStart()
+    _workerInit(annotationProcessorFactory)
+
 def _worker(transAnnotMappings):
     """sub-process worker, if an error occurs an exception object is the returned.
     """
@@ -41,23 +70,126 @@ def _checkForWorkerFail(decoBeds):
     if isinstance(decoBeds, Exception):
         raise Exception("creation of decorator BEDs failed") from decoBeds
 
+##
+# Incremental builds.  A fingerprint of the inputs of each (transcriptId, chrom)
+# group is saved along with the decorators.  The next build regenerates only
+# the groups with a different fingerprint and the decorators for the other
+# groups are copied from the previous BED.
+##
+def _hashRow(hasher, row):
+    hasher.update('\t'.join([str(v) for v in row]).encode())
+    hasher.update(b'\n')
+
+def fingerprintTransAnnotMappings(transAnnotMappings, annotFieldsFunc):
+    """Compute a digest of the inputs for a transcript's decorators.
+    The annotFieldsFunc is called on each annotation and returns a
+    tuple of the fields that effect the decorators."""
+    hasher = hashlib.blake2b(digest_size=16)
+    _hashRow(hasher, transAnnotMappings.transPsl.toRow())
+    for annotMapping in transAnnotMappings.annotMappings:
+        _hashRow(hasher, annotMapping.annotRef)
+        if annotMapping.annotPsl is not None:
+            _hashRow(hasher, annotMapping.annotPsl.toRow())
+        _hashRow(hasher, annotFieldsFunc(annotMapping.annot))
+    return hasher.hexdigest()
+
+def decoratorFingerprintsLoad(fingerprintsTsv):
+    "load fingerprints TSV into a dict of (transcriptId, chrom) to fingerprint"
+    return {(row.transcriptId, row.chrom): row.fingerprint
+            for row in TsvReader(fingerprintsTsv)}
+
+def decoratorFingerprintsWrite(fingerprints, fingerprintsTsv):
+    with fileOps.AtomicFileCreate(fingerprintsTsv) as tmpTsv:
+        with fileOps.opengz(tmpTsv, 'w') as fh:
+            fileOps.prRowv(fh, "transcriptId", "chrom", "fingerprint")
+            for transIdChrom in sorted(fingerprints.keys()):
+                fileOps.prRowv(fh, *transIdChrom, fingerprints[transIdChrom])
+
+class IncrementalBuild:
+    """Fingerprinting of decorator inputs and, if a previous build is specified,
+    only rebuilding the changed transcripts.
+
+    Args:
+        fingerprintFunc: called with a TransAnnotMappings object to get its fingerprint.
+        featTypeRowFunc: called with the split columns of a decorator BED row copied from
+            the previous build to get the same feature type tuple as featTypeFunc.
+        fingerprintsTsv: fingerprints of this build are written here if not None (output).
+        prevDecoratorBed: decorator BED from the previous build (input).
+        prevFingerprintsTsv: fingerprints file from the previous build (input).
+        itemMappingsFunc: if the reader passed to buildDecorators yields objects wrapping
+            TransAnnotMappings, this is called on each to get the TransAnnotMappings.
+    """
+    def __init__(self, fingerprintFunc, featTypeRowFunc, fingerprintsTsv, *,
+                 prevDecoratorBed=None, prevFingerprintsTsv=None, itemMappingsFunc=None):
+        if (prevDecoratorBed is None) != (prevFingerprintsTsv is None):
+            raise DecoratorBuildError("both or neither of the previous decorator BED and fingerprints must be specified")
+        self.fingerprintFunc = fingerprintFunc
+        self.featTypeRowFunc = featTypeRowFunc
+        self.itemMappingsFunc = itemMappingsFunc
+        self.fingerprintsTsv = fingerprintsTsv
+        self.prevDecoratorBed = prevDecoratorBed
+        self.prevFingerprints = None
+        if prevFingerprintsTsv is not None:
+            self.prevFingerprints = decoratorFingerprintsLoad(prevFingerprintsTsv)
+        self.fingerprints = {}
+        self.unchanged = set()
+
+    @property
+    def isIncremental(self):
+        return self.prevFingerprints is not None
+
+    def changedFilter(self, transAnnotMappingReader):
+        """generator that records fingerprints and passes through only
+        the changed TransAnnotMappings"""
+        for item in transAnnotMappingReader:
+            transAnnotMappings = item if self.itemMappingsFunc is None else self.itemMappingsFunc(item)
+            transIdChrom = (transAnnotMappings.transcriptId, transAnnotMappings.chrom)
+            fingerprint = self.fingerprintFunc(transAnnotMappings)
+            self.fingerprints[transIdChrom] = fingerprint
+            if self.isIncremental and (self.prevFingerprints.get(transIdChrom) == fingerprint):
+                self.unchanged.add(transIdChrom)
+            else:
+                yield item
+
+    def copyUnchanged(self, keptBedFh, featTypes):
+        "copy decorators for unchanged transcripts from the previous BED, which is sorted"
+        with compressedOpen(self.prevDecoratorBed) as prevFh:
+            for line in prevFh:
+                line = line.rstrip('\n')
+                row = line.split('\t')
+                if decoratedItemParse(row[DECORATED_ITEM_COL]) in self.unchanged:
+                    featTypes.add(self.featTypeRowFunc(row))
+                    print(line, file=keptBedFh)
+
+    def finish(self):
+        if self.fingerprintsTsv is not None:
+            decoratorFingerprintsWrite(self.fingerprints, self.fingerprintsTsv)
+
 def _processSingle(annotationProcessorFactory,
                    transAnnotMappingReader, featTypeFunc,
                    decoBedFh, featTypes):
     # this is easier to debug without mp
     _workerInit(annotationProcessorFactory)
-    for transAnnotMappings in transAnnotMappingReader:
-        decoBeds = _worker(transAnnotMappings)
-        _checkForWorkerFail(decoBeds)
-        for decoBed in decoBeds:
-            featTypes.add(featTypeFunc(decoBed))
-            decoBed.write(decoBedFh)
+    cnt = 0
+    with progressTrack("buildDecorators", unit="transcripts") as progress:
+        for transAnnotMappings in transAnnotMappingReader:
+            decoBeds = _worker(transAnnotMappings)
+            _checkForWorkerFail(decoBeds)
+            for decoBed in decoBeds:
+                featTypes.add(featTypeFunc(decoBed))
+                decoBed.write(decoBedFh)
+            cnt += len(decoBeds)
+            progress.update()
+    return cnt
 
 def _processMulti(annotationProcessorFactory,
                   transAnnotMappingReader, featTypeFunc, nprocs,
                   decoBedFh, featTypes):
-    with mp.Pool(processes=nprocs, initializer=_workerInit,
-                 initargs=((annotationProcessorFactory,))) as pool:
+    import multiprocessing as mp
+    cnt = 0
+    with mp.Pool(processes=nprocs, initializer=_poolWorkerInit,
+                 initargs=((annotationProcessorFactory,))) as pool, \
+         progressTrack("buildDecorators", unit="transcripts") as progress:
         decoBedIters = pool.imap_unordered(_worker,
                                            transAnnotMappingReader)
         for decoBeds in decoBedIters:
@@ -65,22 +197,48 @@ def _processMulti(annotationProcessorFactory,
             for decoBed in decoBeds:
                 featTypes.add(featTypeFunc(decoBed))
                 decoBed.write(decoBedFh)
+            cnt += len(decoBeds)
+            progress.update()
+        # let workers exit normally so profiles are written
+        pool.close()
+        pool.join()
+    return cnt
 
 def _processMappings(annotationProcessorFactory, transAnnotMappingReader,
                      featTypeFunc, nprocs, decoBedFh, featTypes):
     # special case one process makes debugging & profiling easier
     if nprocs == 1:
-        _processSingle(annotationProcessorFactory,
-                       transAnnotMappingReader, featTypeFunc,
-                       decoBedFh, featTypes)
+        return _processSingle(annotationProcessorFactory,
+                              transAnnotMappingReader, featTypeFunc,
+                              decoBedFh, featTypes)
     else:
-        _processMulti(annotationProcessorFactory,
-                      transAnnotMappingReader, featTypeFunc, nprocs,
-                      decoBedFh, featTypes)
+        return _processMulti(annotationProcessorFactory,
+                             transAnnotMappingReader, featTypeFunc, nprocs,
+                             decoBedFh, featTypes)
 
 
+def _buildIncremental(annotationProcessorFactory, transAnnotMappingReader,
+                      featTypeFunc, annotDecoratorBedFile, nprocs, incremental, featTypes):
+    """sort only the regenerated decorators and merge them with the ones
+    kept from the previous build, returning the number regenerated"""
+    changedBed = fileOps.tmpFileGet(suffix=".changed.bed")
+    keptBed = fileOps.tmpFileGet(suffix=".kept.bed")
+    try:
+        with pipettor.Popen(_sortCmd + decoratorBedSortOpts, 'w', stdout=changedBed) as decoBedFh:
+            cnt = _processMappings(annotationProcessorFactory, transAnnotMappingReader, featTypeFunc, nprocs,
+                                   decoBedFh, featTypes)
+        with open(keptBed, 'w') as keptBedFh:
+            incremental.copyUnchanged(keptBedFh, featTypes)
+        with fileOps.AtomicFileCreate(annotDecoratorBedFile) as tmpDecoBed:
+            pipettor.run(_sortCmd + ["--merge"] + decoratorBedSortOpts + [changedBed, keptBed], stdout=tmpDecoBed)
+        return cnt
+    finally:
+        for tmpBed in (changedBed, keptBed):
+            if os.path.exists(tmpBed):
+                os.unlink(tmpBed)
+
 def buildDecorators(annotationProcessorFactory, transAnnotMappingReader,
-                    featTypeFunc, annotDecoratorBedFile, nprocs):
+                    featTypeFunc, annotDecoratorBedFile, nprocs, *, incremental=None):
     """
     Reads mapped annotation alignments and metadata for target transcripts, including
     those that did not align successfully. Yields TransAnnotMapping objects.
@@ -94,10 +252,22 @@ def buildDecorators(annotationProcessorFactory, transAnnotMappingReader,
 
     Yields:
         TransAnnotMapping: An object representing an annotation's genomic mapping.
+
+    If incremental is an IncrementalBuild object, fingerprints are recorded
+    and, if it has a previous build, only changed transcripts are rebuilt.
         """
     featTypes = set()
-    with fileOps.AtomicFileCreate(annotDecoratorBedFile) as tmpDecoBed:
-        with pipettor.Popen(["sort"] + decoratorBedSortOpts, 'w', stdout=tmpDecoBed) as decoBedFh:
-            _processMappings(annotationProcessorFactory, transAnnotMappingReader, featTypeFunc, nprocs,
-                             decoBedFh, featTypes)
+    if incremental is not None:
+        transAnnotMappingReader = incremental.changedFilter(transAnnotMappingReader)
+    with timedStage("buildDecorators") as stage:
+        if (incremental is not None) and incremental.isIncremental:
+            stage.records = _buildIncremental(annotationProcessorFactory, transAnnotMappingReader,
+                                              featTypeFunc, annotDecoratorBedFile, nprocs, incremental, featTypes)
+        else:
+            with fileOps.AtomicFileCreate(annotDecoratorBedFile) as tmpDecoBed:
+                with pipettor.Popen(_sortCmd + decoratorBedSortOpts, 'w', stdout=tmpDecoBed) as decoBedFh:
+                    stage.records = _processMappings(annotationProcessorFactory, transAnnotMappingReader,
+                                                     featTypeFunc, nprocs, decoBedFh, featTypes)
+    if incremental is not None:
+        incremental.finish()
     return featTypes
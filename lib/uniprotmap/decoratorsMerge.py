@@ -0,0 +1,60 @@
+"""
+Merge sorted decorator BEDs in-process.  Ordering matches running sort(1)
+with --merge and decoratorBedSortOpts in the C locale; that is fields are
+separated by blanks and lines with equal keys are ordered by comparing the
+whole line.  Compressed inputs and output are decompressed and compressed
+in background threads.
+"""
+import re
+import heapq
+from pycbio.sys import fileOps
+from uniprotmap.decoratorsBuilder import decoratorBedSortKeys
+from uniprotmap.compressedFiles import compressedOpen, CompressType
+
+class DecoratorMergeError(Exception):
+    pass
+
+# sort(1) field: leading blanks followed by non-blanks
+_maxKeyCol = max(col for col, _ in decoratorBedSortKeys)
+_sortFieldsRe = re.compile(_maxKeyCol * r'([ \t]*[^ \t]*)')
+_sortNumRe = re.compile(r'[ \t]*(-?)([0-9]*)(?:\.([0-9]*))?')
+
+def _sortNumKey(field):
+    "sort -n value of a field, non-numeric is zero"
+    m = _sortNumRe.match(field)
+    sign, intPart, fracPart = m.groups()
+    if fracPart:
+        value = float(f"{intPart or '0'}.{fracPart}")
+    else:
+        value = int(intPart or '0')
+    return -value if sign else value
+
+def decoratorBedSortKey(line):
+    """Sort key tuple for a decorator BED line, without newline.  The last
+    element is the line, as with sort's last-resort comparison."""
+    fields = _sortFieldsRe.match(line).groups()
+    return tuple([_sortNumKey(fields[col - 1]) if numeric else fields[col - 1]
+                  for col, numeric in decoratorBedSortKeys]) + (line,)
+
+def decoratorBedKeyReader(bedFile):
+    """Read a sorted decorator BED, which maybe compressed, yielding the sort key
+    of each line; the last element of the key is the line with the newline removed.
+    Raises DecoratorMergeError if not sorted."""
+    prevKey = None
+    with compressedOpen(bedFile) as fh:
+        for lineNum, line in enumerate(fh, 1):
+            line = line.rstrip('\n')
+            key = decoratorBedSortKey(line)
+            if (prevKey is not None) and (key < prevKey):
+                raise DecoratorMergeError(f"decorator BED is not sorted: {bedFile}:{lineNum}")
+            yield key
+            prevKey = key
+
+def decoratorBedsMerge(inputBeds, outBed, *, bgzip=False):
+    """Merge sorted decorator BEDs, optionally compressing the output
+    with BGZF."""
+    compressType = CompressType.bgzf if bgzip else CompressType.none
+    with fileOps.AtomicFileCreate(outBed) as tmpOutBed:
+        with compressedOpen(tmpOutBed, 'w', compressType=compressType) as fh:
+            for key in heapq.merge(*[decoratorBedKeyReader(b) for b in inputBeds]):
+                fh.write(key[-1] + '\n')
@@ -1,7 +1,18 @@
 """
 check and dirty file generation dependency checking
+
+By default, targets are out of date when dependencies are newer.  With
+byContent, a manifest of the size and a digest of each dependency and of
+parameters is saved beside the done file.  Rebuilds only happen if the content
+changes, so copying or restoring files that resets modification times doesn't
+force reruns.  Files with unchanged size and modification time are not
+rehashed.
 """
+import os
 from os import path as osp
+import hashlib
+from collections import namedtuple
+from pycbio.sys import fileOps
 
 class DependsError(Exception):
     pass
@@ -10,6 +21,10 @@ def getDoneFile(target):
     "get path to done file corresponding to target"
     return osp.normpath(target) + ".done"
 
+def getManifestFile(target):
+    "get path to content manifest file corresponding to target"
+    return getDoneFile(target) + ".manifest"
+
 def _normalizeDepends(depends):
     "make list if str or None"
     if depends is None:
@@ -39,6 +54,115 @@ def _checkDoneDepends(doneDepends):
 def _isDoneOutOfDate(doneFile, doneDepends):
     return _isOutOfDate(doneFile, [getDoneFile(d) for d in doneDepends])
 
+##
+# content manifests
+##
+_hashBufSize = 1024 * 1024
+
+class ManifestEntry(namedtuple("ManifestEntry",
+                               ("kind", "name", "size", "mtime", "digest"))):
+    """One dependency in a manifest.  The kind is file, done, or params.
+    The mtime is only used to avoid rehashing files and is not compared."""
+    __slots__ = ()
+
+    def contentKey(self):
+        return (self.kind, self.name, self.size, self.digest)
+
+_manifestHeader = "\t".join(ManifestEntry._fields)
+
+def fileDigest(path):
+    "fast digest of the contents of a file, computed in chunks"
+    hasher = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as fh:
+        while True:
+            buf = fh.read(_hashBufSize)
+            if len(buf) == 0:
+                break
+            hasher.update(buf)
+    return hasher.hexdigest()
+
+def _fileEntry(kind, name, path, oldEntries):
+    st = os.stat(path)
+    oldEntry = oldEntries.get((kind, name))
+    if (oldEntry is not None) and (oldEntry.size == st.st_size) and (oldEntry.mtime == st.st_mtime_ns):
+        digest = oldEntry.digest
+    else:
+        digest = fileDigest(path)
+    return ManifestEntry(kind, name, st.st_size, st.st_mtime_ns, digest)
+
+def _reprDigest(obj):
+    return hashlib.blake2b(repr(obj).encode(), digest_size=16).hexdigest()
+
+def _doneEntry(doneDepend):
+    """A done dependency is represented by the content of its manifest if it
+    has one, otherwise by the modification time of the done file."""
+    entries = manifestRead(getManifestFile(doneDepend))
+    if entries is not None:
+        return ManifestEntry("done", doneDepend, len(entries), 0,
+                             _reprDigest([e.contentKey() for e in entries]))
+    st = os.stat(getDoneFile(doneDepend))
+    return ManifestEntry("done", doneDepend, 0, st.st_mtime_ns, f"mtime:{st.st_mtime_ns}")
+
+def _paramsEntry(params):
+    "params is a dict or other object with a stable repr"
+    if isinstance(params, dict):
+        params = sorted(params.items())
+    return ManifestEntry("params", "params", 0, 0, _reprDigest(params))
+
+def _manifestBuild(depends, doneDepends, params, oldEntries):
+    entries = [_fileEntry("file", depend, depend, oldEntries) for depend in depends]
+    entries.extend([_doneEntry(doneDepend) for doneDepend in doneDepends])
+    if params is not None:
+        entries.append(_paramsEntry(params))
+    return entries
+
+def _parseManifestLine(manifestFile, line):
+    row = line.split('\t')
+    if len(row) != len(ManifestEntry._fields):
+        raise DependsError(f"invalid manifest line: {manifestFile}: {line}")
+    return ManifestEntry(row[0], row[1], int(row[2]), int(row[3]), row[4])
+
+def manifestRead(manifestFile):
+    "read manifest into a list of ManifestEntry, None if it doesn't exist"
+    if not osp.exists(manifestFile):
+        return None
+    with open(manifestFile) as fh:
+        lines = fh.read().splitlines()
+    if (len(lines) == 0) or (lines[0] != _manifestHeader):
+        raise DependsError(f"invalid manifest header: {manifestFile}")
+    return [_parseManifestLine(manifestFile, line) for line in lines[1:]]
+
+def manifestWrite(manifestFile, entries):
+    with fileOps.AtomicFileCreate(manifestFile) as tmpManifestFile:
+        with open(tmpManifestFile, 'w') as fh:
+            print(_manifestHeader, file=fh)
+            for entry in entries:
+                print(*entry, sep='\t', file=fh)
+
+def _contentChanged(oldEntries, newEntries):
+    return [e.contentKey() for e in oldEntries] != [e.contentKey() for e in newEntries]
+
+class _ContentCheck:
+    """Content-based out-of-date check of a target.  If there is no manifest
+    yet, such as for a done file created without byContent, checking falls
+    back to modification times and the manifest is then created."""
+    def __init__(self, target, depends, doneDepends, params):
+        self.manifestFile = getManifestFile(target)
+        self.oldEntries = manifestRead(self.manifestFile)
+        oldEntryMap = {(e.kind, e.name): e for e in (self.oldEntries or ())}
+        self.entries = _manifestBuild(depends, doneDepends, params, oldEntryMap)
+
+    def isOutOfDate(self, checkTimes):
+        "checkTimes is called to do modification time check if no manifest"
+        if self.oldEntries is None:
+            return checkTimes()
+        return _contentChanged(self.oldEntries, self.entries)
+
+    def update(self):
+        "save manifest if anything, including modification times, changed"
+        if self.entries != self.oldEntries:
+            manifestWrite(self.manifestFile, self.entries)
+
 class runIfNotDone:
     """Context manager for a Cheap make-like hack. Checks if a flag file to
     see if something is done. The with context returns a True if target needs
@@ -49,9 +173,13 @@ class runIfNotDone:
     If the body succeeds, a file target.done is created. If target is a
     directory, create a file target.done beside it, not inside of it.
 
+    If byContent is specified, the content of depends and params, which is
+    a dict or object with a stable repr, are compared to the manifest saved
+    in target.done.manifest rather than comparing modification times.
+    Params are ignored without byContent.
     """
 
-    def __init__(self, target, *, depends=None, doneDepends=None):
+    def __init__(self, target, *, depends=None, doneDepends=None, byContent=False, params=None):
         "depends can be a string filename or list"
         depends = _normalizeDepends(depends)
         _checkDepends(depends)
@@ -59,37 +187,61 @@ class runIfNotDone:
         _checkDoneDepends(doneDepends)
 
         self.doneFile = getDoneFile(target)
-        self.outOfDate = ((not osp.exists(self.doneFile)) or
-                          _isOutOfDate(self.doneFile, depends) or
-                          _isDoneOutOfDate(self.doneFile, doneDepends))
+        self.contentCheck = _ContentCheck(target, depends, doneDepends, params) if byContent else None
+        if not osp.exists(self.doneFile):
+            self.outOfDate = True
+        elif self.contentCheck is not None:
+            self.outOfDate = self.contentCheck.isOutOfDate(lambda: (_isOutOfDate(self.doneFile, depends) or
+                                                                    _isDoneOutOfDate(self.doneFile, doneDepends)))
+        else:
+            self.outOfDate = (_isOutOfDate(self.doneFile, depends) or
+                              _isDoneOutOfDate(self.doneFile, doneDepends))
 
     def __enter__(self):
         return self.outOfDate
 
     def __exit__(self, exc_type, exc_value, traceback):
-        if (exc_type is None) and self.outOfDate:
-            open(self.doneFile, 'w').close()
+        if exc_type is None:
+            if self.outOfDate:
+                open(self.doneFile, 'w').close()
+            if self.contentCheck is not None:
+                self.contentCheck.update()
 
 class runIfOutOfDate:
     """Context manager for a Cheap make-like hack. Checks if an atomically
     create does not exist or is out-of-date with optional dependencies
     or done flag files for dependenices.
     The with context returns a True if target needs built, false otherwise.
+
+    If byContent is specified, content is checked as with runIfNotDone, with
+    the manifest saved in target.done.manifest, although no done file is
+    created.
     """
 
-    def __init__(self, target, *, depends=None, doneDepends=None):
+    def __init__(self, target, *, depends=None, doneDepends=None, byContent=False, params=None):
         "depends can be a string filename or list"
         if isinstance(depends, str):
             depends = [depends]
         if isinstance(doneDepends, str):
             doneDepends = [doneDepends]
 
-        self.outOfDate = ((not osp.exists(target)) or
-                          ((depends is not None) and _isOutOfDate(target, depends)) or
-                          ((doneDepends is not None) and _isDoneOutOfDate(target, doneDepends)))
+        self.contentCheck = (_ContentCheck(target, _normalizeDepends(depends), _normalizeDepends(doneDepends), params)
+                             if byContent else None)
+        if not osp.exists(target):
+            self.outOfDate = True
+        elif self.contentCheck is not None:
+            self.outOfDate = self.contentCheck.isOutOfDate(lambda: self._isOutOfDate(target, depends, doneDepends))
+        else:
+            self.outOfDate = self._isOutOfDate(target, depends, doneDepends)
+
+    @staticmethod
+    def _isOutOfDate(target, depends, doneDepends):
+        return (((depends is not None) and _isOutOfDate(target, depends)) or
+                ((doneDepends is not None) and _isDoneOutOfDate(target, doneDepends)))
 
     def __enter__(self):
         return self.outOfDate
 
     def __exit__(self, exc_type, exc_value, traceback):
-        pass
+        if (exc_type is None) and (self.contentCheck is not None):
+            self.contentCheck.update()
@@ -1,12 +1,20 @@
 """
 Abstraction of a gene set, allowing code to work with GENCODE, RefSeq and CAT.
 """
+import sys
+import math
+import bisect
+from array import array
 from collections import namedtuple, defaultdict
+from itertools import accumulate
+from functools import partial
 from pycbio.sys.symEnum import SymEnum, auto
-from pycbio.hgdata.psl import PslReader
+from pycbio.hgdata.psl import Psl, PslBlock
 from pycbio.hgdata.genePred import GenePredReader
-from pycbio.hgdata.rangeFinder import RangeFinder
 from uniprotmap import dropVersion
+from uniprotmap.instrument import timedStage
+from uniprotmap.progress import progressIter
+from uniprotmap.compressedFiles import compressedPslReader
 
 ##
 # Note: this came from a different project, so not all of the functionality is
@@ -141,36 +149,181 @@ class GeneSetMetadata:
         except Exception as ex:
             raise GeneSetError(f"can't find gene for gene `{geneId}'") from ex
 
-class Entry:
-    "PSL and option genePred"
-    __slots__ = ("psl", "gp")
+class PslStore:
+    """Compact storage of PSL alignments as parallel integer arrays, with the
+    blocks of all alignments concatenated.  Name and strand strings are interned.
+    Psl objects are only created when requested; block sequences are not kept."""
+    countFields = ("match", "misMatch", "repMatch", "nCount",
+                   "qNumInsert", "qBaseInsert", "tNumInsert", "tBaseInsert")
+    coordFields = ("qSize", "qStart", "qEnd", "tSize", "tStart", "tEnd")
 
     def __init__(self):
-        self.psl = None
+        self.qNames = []
+        self.tNames = []
+        self.strands = []
+        self.cols = {field: array('I') for field in self.countFields + self.coordFields}
+        self.blkOffsets = array('I', [0])
+        self.blkQStarts = array('I')
+        self.blkTStarts = array('I')
+        self.blkSizes = array('I')
+
+    def __len__(self):
+        return len(self.qNames)
+
+    def add(self, psl):
+        "add a PSL, returning its index"
+        iPsl = len(self.qNames)
+        self.qNames.append(sys.intern(psl.qName))
+        self.tNames.append(sys.intern(psl.tName))
+        self.strands.append(sys.intern(psl.strand))
+        for field, col in self.cols.items():
+            col.append(getattr(psl, field))
+        for blk in psl.blocks:
+            self.blkQStarts.append(blk.qStart)
+            self.blkTStarts.append(blk.tStart)
+            self.blkSizes.append(blk.size)
+        self.blkOffsets.append(len(self.blkSizes))
+        return iPsl
+
+    def getPsl(self, iPsl):
+        "create a Psl object for the alignment at an index"
+        cols = self.cols
+        psl = Psl(qName=self.qNames[iPsl], qSize=cols["qSize"][iPsl],
+                  qStart=cols["qStart"][iPsl], qEnd=cols["qEnd"][iPsl],
+                  tName=self.tNames[iPsl], tSize=cols["tSize"][iPsl],
+                  tStart=cols["tStart"][iPsl], tEnd=cols["tEnd"][iPsl],
+                  strand=self.strands[iPsl])
+        for field in self.countFields:
+            setattr(psl, field, cols[field][iPsl])
+        for iBlk in range(self.blkOffsets[iPsl], self.blkOffsets[iPsl + 1]):
+            psl.addBlock(PslBlock(qStart=self.blkQStarts[iBlk], tStart=self.blkTStarts[iBlk],
+                                  size=self.blkSizes[iBlk]))
+        return psl
+
+class Entry:
+    """PSL and option genePred.  The PSL is kept in a PslStore and a Psl
+    object is created each time the psl property is accessed."""
+    __slots__ = ("pslStore", "iPsl", "gp")
+
+    def __init__(self, pslStore):
+        self.pslStore = pslStore
+        self.iPsl = None
         self.gp = None
 
+    @property
+    def psl(self):
+        return self.pslStore.getPsl(self.iPsl) if self.iPsl is not None else None
+
     @property
     def name(self):
-        return self.psl.qName if self.psl is not None else self.gp.name
+        return self.pslStore.qNames[self.iPsl] if self.iPsl is not None else self.gp.name
 
     @property
     def chrom(self):
-        return self.psl.tName if self.psl is not None else self.gp.chrom
+        return self.pslStore.tNames[self.iPsl] if self.iPsl is not None else self.gp.chrom
 
     @property
     def start(self):
-        return self.psl.tStart if self.psl is not None else self.gp.txStart
+        return self.pslStore.cols["tStart"][self.iPsl] if self.iPsl is not None else self.gp.txStart
 
     @property
     def end(self):
-        return self.psl.tEnd if self.psl is not None else self.gp.txEnd
+        return self.pslStore.cols["tEnd"][self.iPsl] if self.iPsl is not None else self.gp.txEnd
 
     @property
     def strand(self):
-        return self.psl.qStrand if self.psl is not None else self.gp.strand
+        return self.pslStore.strands[self.iPsl][0] if self.iPsl is not None else self.gp.strand
+
+class _EntryRanges:
+    """Entries on one chromosome and strand, sorted by start, along with the
+    running maximum of the ends.  As the running maximum doesn't decrease,
+    binary search finds the first entry that could reach a position.
+    The worst case is a query within a long entry, which scans every entry
+    from the long one to the end of the query, so batches of queries should
+    use overlappingSweep()."""
+    __slots__ = ("entries", "starts", "maxEnds")
+
+    def __init__(self, entries):
+        self.entries = sorted(entries, key=lambda e: (e.start, e.end))
+        self.starts = [e.start for e in self.entries]
+        self.maxEnds = list(accumulate((e.end for e in self.entries), max))
+
+    def overlapping(self, start, end):
+        iStart = bisect.bisect_right(self.maxEnds, start)
+        iEnd = bisect.bisect_left(self.starts, end)
+        return [e for e in self.entries[iStart:iEnd] if e.end > start]
+
+    def overlappingSweep(self, ranges):
+        """Given a list of (start, end) ranges sorted by start, return the list
+        of overlapping entries for each.  A single pass is made over the
+        entries, keeping the active ones that have not ended before the
+        current start, in the same order as overlapping().  Ended entries are
+        only removed once the start passes the minimum end of the active
+        entries."""
+        results = []
+        active = []
+        minEnd = math.inf
+        iNext = 0
+        for start, end in ranges:
+            if start >= minEnd:
+                active = [e for e in active if e.end > start]
+                minEnd = min((e.end for e in active), default=math.inf)
+            while (iNext < len(self.entries)) and (self.starts[iNext] < end):
+                entry = self.entries[iNext]
+                if entry.end > start:
+                    active.append(entry)
+                    minEnd = min(minEnd, entry.end)
+                iNext += 1
+            results.append([e for e in active if e.start < end])
+        return results
+
+class EntryRangeIndex:
+    """Genomic range index of Entry objects by chromosome and strand."""
+    def __init__(self, entries):
+        byChromStrand = defaultdict(list)
+        for entry in entries:
+            byChromStrand[(entry.chrom, entry.strand)].append(entry)
+        self.byChromStrand = {cs: _EntryRanges(cse) for cs, cse in byChromStrand.items()}
+        self.strandsByChrom = defaultdict(list)
+        for chrom, strand in sorted(self.byChromStrand.keys()):
+            self.strandsByChrom[chrom].append(strand)
+        self.strandsByChrom.default_factory = None
+
+    def _getRanges(self, chrom, strand):
+        "list of _EntryRanges, strand of None is both strands"
+        if strand is None:
+            return [self.byChromStrand[(chrom, s)] for s in self.strandsByChrom.get(chrom, ())]
+        ranges = self.byChromStrand.get((chrom, strand))
+        return [] if ranges is None else [ranges]
+
+    def overlapping(self, chrom, start, end, strand=None):
+        "list of entries overlapping range, strand of None matches either strand"
+        overlaps = []
+        for ranges in self._getRanges(chrom, strand):
+            overlaps.extend(ranges.overlapping(start, end))
+        return overlaps
+
+    def overlappingBulk(self, queries):
+        """Given a sequence of (chrom, start, end, strand) queries, return a list
+        of the overlapping entries for each, in the order of the queries.
+        Queries are grouped by chrom and strand and sorted by start, then the
+        entries of each group are swept once for all of its queries.  This is
+        fastest when the queries are of similar sizes, such as transcripts."""
+        queryIdxs = defaultdict(list)
+        for iQuery, (chrom, start, end, strand) in enumerate(queries):
+            queryIdxs[(chrom, strand)].append(iQuery)
+        results = [[] for _ in range(len(queries))]
+        for (chrom, strand), iQueries in queryIdxs.items():
+            iQueries.sort(key=lambda i: queries[i][1])
+            queryRanges = [(queries[i][1], queries[i][2]) for i in iQueries]
+            for ranges in self._getRanges(chrom, strand):
+                for iQuery, overlaps in zip(iQueries, ranges.overlappingSweep(queryRanges)):
+                    results[iQuery].extend(overlaps)
+        return results
 
 class GeneSetData:
-    """contains PSL alignments and optional genePred annotation records."""
+    """contains PSL alignments and optional genePred annotation records.
+    Alignments are kept in a PslStore."""
 
     ##
     # Note: RefSeq and older GENCODEs will have same transcript ids for PARs, so we must keep
@@ -178,6 +331,7 @@ class GeneSetData:
     ##
 
     def __init__(self):
+        self.pslStore = PslStore()
         self.entries = []
         self.byTransId = defaultdict(list)
         self.rangeIdx = None
@@ -188,22 +342,23 @@ class GeneSetData:
     def _obtainEntry(self, name, chrom):
         entry = self.findEntry(name, chrom)
         if entry is None:
-            entry = Entry()
+            entry = Entry(self.pslStore)
             self.entries.append(entry)
             self.byTransId[name].append(entry)
         return entry
 
     def addAlign(self, psl):
-        self._obtainEntry(psl.qName, psl.tName).psl = psl
+        self._obtainEntry(psl.qName, psl.tName).iPsl = self.pslStore.add(psl)
+        self.rangeIdx = None
 
     def addAnnot(self, gp):
         self._obtainEntry(gp.name, gp.chrom).gp = gp
+        self.rangeIdx = None
 
-    def _buildRangeIdx(self):
-        self.rangeIdx = RangeFinder()
-        for entries in self.byTransId.values():
-            for entry in entries:
-                self.rangeIdx.add(entry.name, entry.start, entry.end)
+    def _getRangeIdx(self):
+        if self.rangeIdx is None:
+            self.rangeIdx = EntryRangeIndex(self.entries)
+        return self.rangeIdx
 
     def findEntries(self, transId):
         return self.byTransId.get(transId, ())
@@ -234,16 +389,19 @@ class GeneSetData:
     def getAnnot(self, transId, chrom):
         return self.getEntry(transId, chrom).gp
 
-    def getOverEntries(self, name, start, end, strand):
-        if self.rangeIdx is None:
-            self._buildRangeIdx()
-        for entry in self.rangeIdx.overlapping(self, name, start, end):
-            if entry.strand == strand:
-                yield entry
+    def getOverEntries(self, chrom, start, end, strand=None):
+        """list of entries overlapping the genomic range, strand of None
+        matches either strand"""
+        return self._getRangeIdx().overlapping(chrom, start, end, strand)
+
+    def getOverEntriesBulk(self, queries):
+        """list of overlapping entries for each of the sequence of
+        (chrom, start, end, strand) queries"""
+        return self._getRangeIdx().overlappingBulk(queries)
 
 def geneSetLoadAnnotPsl(geneSetData, trans2GenomePslFile):
     """"load PSLs into a GeneSetData object"""
-    for psl in PslReader(trans2GenomePslFile):
+    for psl in progressIter(compressedPslReader(trans2GenomePslFile), f"reading {trans2GenomePslFile}", unit="PSLs"):
         geneSetData.addAlign(psl)
 
 def geneSetLoadAnnotGp(geneSetData, annotGpFile):
@@ -251,6 +409,24 @@ def geneSetLoadAnnotGp(geneSetData, annotGpFile):
     for gp in GenePredReader(annotGpFile):
         geneSetData.addAnnot(gp)
 
+def _geneSetDataPslLoad(trans2GenomePslFile):
+    geneSetData = GeneSetData()
+    geneSetLoadAnnotPsl(geneSetData, trans2GenomePslFile)
+    return geneSetData
+
+def geneSetDataPslLoad(trans2GenomePslFile, *, cacheDir=None):
+    """Create a GeneSetData object with only the PSL alignments. If cacheDir
+    is not None, the data is loaded from or saved in the cache."""
+    with timedStage("geneSetDataPslLoad") as stage:
+        if cacheDir is None:
+            geneSetData = _geneSetDataPslLoad(trans2GenomePslFile)
+        else:
+            from uniprotmap.genesetCache import geneSetCachedLoad
+            geneSetData = geneSetCachedLoad(cacheDir, "geneSetData", (trans2GenomePslFile,),
+                                            partial(_geneSetDataPslLoad, trans2GenomePslFile))
+        stage.records = len(geneSetData.entries)
+    return geneSetData
+
 
 class GeneSet:
     """Meta data and data for GeneSet. A factory function builds this
@@ -267,9 +443,7 @@ class GeneSet:
         self.meta.finish()
 
 
-def geneSetFactory(geneSetName, *, geneSetMetadata=None, trans2GenomePslFile=None, transGenomeGpFile=None, transFa=None):
-    """Build gene set object of the specified type GeneSet"""
-
+def _geneSetFactory(geneSetName, *, geneSetMetadata=None, trans2GenomePslFile=None, transGenomeGpFile=None, transFa=None):
     if geneSetName is GeneSetName.GENCODE:
         from uniprotmap.gencode import gencodeGeneSetFactory
         return gencodeGeneSetFactory(geneSetName, geneSetMetadata=geneSetMetadata,
@@ -281,3 +455,29 @@ def geneSetFactory(geneSetName, *, geneSetMetadata=None, trans2GenomePslFile=Non
                                   trans2GenomePslFile=trans2GenomePslFile, transGenomeGpFile=transGenomeGpFile, transFa=transFa)
     else:
         assert False, f"Bug: no handler for {geneSetName}"
+
+def geneSetFactory(geneSetName, *, geneSetMetadata=None, trans2GenomePslFile=None, transGenomeGpFile=None, transFa=None,
+                   cacheDir=None):
+    """Build gene set object of the specified type GeneSet.  If cacheDir is
+    not None, the gene set is loaded from or saved in the cache.  The
+    transcript FASTA is not part of the cached data."""
+    with timedStage(f"geneSet.{geneSetName}") as stage:
+        geneSet = _geneSetFactoryCached(geneSetName, geneSetMetadata=geneSetMetadata,
+                                        trans2GenomePslFile=trans2GenomePslFile, transGenomeGpFile=transGenomeGpFile,
+                                        transFa=transFa, cacheDir=cacheDir)
+        stage.records = len(geneSet.data.entries)
+    return geneSet
+
+def _geneSetFactoryCached(geneSetName, *, geneSetMetadata, trans2GenomePslFile, transGenomeGpFile, transFa,
+                          cacheDir):
+    if cacheDir is None:
+        return _geneSetFactory(geneSetName, geneSetMetadata=geneSetMetadata,
+                               trans2GenomePslFile=trans2GenomePslFile, transGenomeGpFile=transGenomeGpFile,
+                               transFa=transFa)
+    from uniprotmap.genesetCache import geneSetCachedLoad
+    geneSet = geneSetCachedLoad(cacheDir, f"geneSet.{geneSetName}",
+                                (geneSetMetadata, trans2GenomePslFile, transGenomeGpFile),
+                                partial(_geneSetFactory, geneSetName, geneSetMetadata=geneSetMetadata,
+                                        trans2GenomePslFile=trans2GenomePslFile, transGenomeGpFile=transGenomeGpFile))
+    geneSet.transFa = transFa
+    return geneSet
@@ -0,0 +1,113 @@
+"""
+On-disk cache of loaded gene sets.  Cache files are named by a digest of the
+content of the input files, so a changed input results in a new cache entry
+rather than stale data.  Entries are pickled, avoiding parsing the text
+inputs on every invocation.
+
+Hashing large inputs is itself slow, so the digest is saved in a stamp file
+along with the size and modification time of each input.  If these have not
+changed, the saved digest is used rather than hashing the inputs again.
+"""
+import os
+import os.path as osp
+import pickle
+import hashlib
+from pycbio.sys import fileOps
+
+# increment when the pickled classes change in incompatible ways
+_cacheFormatVersion = 2
+
+_hashBufSize = 1024 * 1024
+
+def _hashFile(hasher, inFile):
+    with open(inFile, 'rb') as fh:
+        while True:
+            buf = fh.read(_hashBufSize)
+            if len(buf) == 0:
+                break
+            hasher.update(buf)
+
+def geneSetCacheKey(kind, inputFiles):
+    """Compute the cache key for data of kind (a string) loaded from a
+    sequence of input files, which maybe None for ones not used."""
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(f"{kind}\t{_cacheFormatVersion}\n".encode())
+    for inFile in inputFiles:
+        if inFile is None:
+            hasher.update(b'\0')
+        else:
+            _hashFile(hasher, inFile)
+        hasher.update(b'\n')
+    return hasher.hexdigest()
+
+def _inputStamps(inputFiles):
+    """size and modification time of each input, or None if an input is
+    not a regular file, so it can't be checked this way"""
+    stamps = []
+    for inFile in inputFiles:
+        if inFile is None:
+            stamps.append("-")
+        elif not osp.isfile(inFile):
+            return None
+        else:
+            st = os.stat(inFile)
+            stamps.append(f"{st.st_size}\t{st.st_mtime_ns}")
+    return stamps
+
+def _stampFileName(cacheDir, kind, inputFiles):
+    "stamp file is named by a digest of the input file paths"
+    hasher = hashlib.blake2b(digest_size=16)
+    for inFile in inputFiles:
+        hasher.update(("-" if inFile is None else osp.abspath(inFile)).encode() + b'\n')
+    return osp.join(cacheDir, f"{kind}.{hasher.hexdigest()}.stamp")
+
+def _stampRead(stampFile, stamps):
+    "get cache key from stamp file if the inputs are unchanged, otherwise None"
+    try:
+        with open(stampFile) as fh:
+            lines = fh.read().splitlines()
+    except FileNotFoundError:
+        return None
+    if lines[1:] != stamps:
+        return None
+    return lines[0]
+
+def _stampWrite(stampFile, cacheKey, stamps):
+    with fileOps.AtomicFileCreate(stampFile) as tmpStampFile:
+        with open(tmpStampFile, 'w') as fh:
+            for line in [cacheKey] + stamps:
+                print(line, file=fh)
+
+def _cacheKeyGet(cacheDir, kind, inputFiles):
+    "get the cache key, from the stamp file if the inputs haven't changed"
+    stamps = _inputStamps(inputFiles)
+    if stamps is None:
+        return geneSetCacheKey(kind, inputFiles)
+    stampFile = _stampFileName(cacheDir, kind, inputFiles)
+    cacheKey = _stampRead(stampFile, stamps)
+    if cacheKey is None:
+        cacheKey = geneSetCacheKey(kind, inputFiles)
+        os.makedirs(cacheDir, exist_ok=True)
+        _stampWrite(stampFile, cacheKey, stamps)
+    return cacheKey
+
+def _cacheLoad(cacheFile):
+    with open(cacheFile, 'rb') as fh:
+        return pickle.load(fh)
+
+def _cacheSave(data, cacheFile):
+    with fileOps.AtomicFileCreate(cacheFile) as tmpCacheFile:
+        with open(tmpCacheFile, 'wb') as fh:
+            pickle.dump(data, fh, protocol=pickle.HIGHEST_PROTOCOL)
+
+def geneSetCachedLoad(cacheDir, kind, inputFiles, loadFunc):
+    """Return the data of kind loaded from inputFiles, from the cache in
+    cacheDir if available.  Otherwise, call loadFunc() to load it and save
+    the result in the cache."""
+    cacheFile = osp.join(cacheDir, f"{kind}.{_cacheKeyGet(cacheDir, kind, inputFiles)}.pickle")
+    if osp.exists(cacheFile):
+        return _cacheLoad(cacheFile)
+    data = loadFunc()
+    os.makedirs(cacheDir, exist_ok=True)
+    _cacheSave(data, cacheFile)
+    return data
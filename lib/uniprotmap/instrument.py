@@ -0,0 +1,163 @@
+"""
+Optional instrumentation of programs: profiling with cProfile, including
+multiprocessing pool workers, and recording of the wall time, CPU time,
+record counts and memory of program stages.
+
+Stages are marked in code with timedStage(), which is a cheap no-op unless
+timings are enabled by Instrumentation, normally through the --timings
+option.  Pool workers are profiled if their initialization function calls
+workerProfileStart(); the per-worker profiles are merged into the program's
+profile.
+"""
+import os
+import sys
+import glob
+import json
+import time
+import resource
+from contextlib import contextmanager
+
+# passes prefix of worker profile files to workers, regardless of how they are started
+_workerProfileEnv = "UNIPROTMAP_WORKER_PROFILE"
+
+def maxRssMbGet():
+    "ru_maxrss is in kilobytes on Linux"
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def rssMbGet():
+    "current RSS, or None if not available"
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024.0 * 1024.0)
+    except OSError:
+        return None
+
+def _cpuSec():
+    "CPU time for this process and children that have been waited for"
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+class StageTiming:
+    """Timing of a program stage.  Code being timed sets records or calls
+    addRecords to count the number of records processed."""
+    __slots__ = ("name", "records", "startWall", "startCpu", "wallSec", "cpuSec", "maxRssMb", "rssMb")
+
+    def __init__(self, name):
+        self.name = name
+        self.records = None
+        self.startWall = time.perf_counter()
+        self.startCpu = _cpuSec()
+        self.wallSec = self.cpuSec = self.maxRssMb = self.rssMb = None
+
+    def addRecords(self, cnt=1):
+        self.records = cnt if self.records is None else self.records + cnt
+
+    def finish(self):
+        self.wallSec = time.perf_counter() - self.startWall
+        self.cpuSec = _cpuSec() - self.startCpu
+        self.maxRssMb = maxRssMbGet()
+        self.rssMb = rssMbGet()
+
+    def toDict(self):
+        return {"name": self.name, "wallSec": self.wallSec, "cpuSec": self.cpuSec,
+                "records": self.records, "maxRssMb": self.maxRssMb, "rssMb": self.rssMb}
+
+class _NullStageTiming:
+    "used when timings are not enabled"
+    __slots__ = ()
+
+    def addRecords(self, cnt=1):
+        pass
+
+    def __setattr__(self, name, value):
+        pass
+
+_nullStageTiming = _NullStageTiming()
+
+# list of StageTiming when timings are enabled, None otherwise
+_gStageTimings = None
+
+@contextmanager
+def timedStage(name):
+    """Context manager to record timings of a stage, returning a StageTiming,
+    or a object that ignores records when timings are not enabled."""
+    if _gStageTimings is None:
+        yield _nullStageTiming
+    else:
+        stage = StageTiming(name)
+        try:
+            yield stage
+        finally:
+            stage.finish()
+            _gStageTimings.append(stage)
+
+def _workerProfileDump(profiler, profileFile):
+    profiler.disable()
+    profiler.dump_stats(profileFile)
+
+def workerProfileStart():
+    """Called by pool worker initialization functions to profile the
+    worker if the program is being profiled.  The profile is written when the
+    worker exits, so the pool must be closed and joined, not terminated."""
+    prefix = os.environ.get(_workerProfileEnv)
+    if prefix is not None:
+        import cProfile
+        from multiprocessing import util as mpUtil
+        profiler = cProfile.Profile()
+        profiler.enable()
+        mpUtil.Finalize(None, _workerProfileDump, args=(profiler, f"{prefix}.{os.getpid()}"),
+                        exitpriority=10)
+
+class Instrumentation:
+    """Context manager that profiles the program to profileFile and/or records
+    stage timings to timingsFile as JSON, if they are not None."""
+    def __init__(self, profileFile=None, timingsFile=None):
+        self.profileFile = profileFile
+        self.timingsFile = timingsFile
+        self.profiler = None
+        self.startWall = self.startCpu = None
+
+    def __enter__(self):
+        global _gStageTimings
+        if self.timingsFile is not None:
+            _gStageTimings = []
+            self.startWall = time.perf_counter()
+            self.startCpu = _cpuSec()
+        if self.profileFile is not None:
+            import cProfile
+            os.environ[_workerProfileEnv] = self._workerProfilePrefix()
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.profiler is not None:
+            self._finishProfile()
+        if self.timingsFile is not None:
+            self._writeTimings(exc_type is None)
+        return False
+
+    def _workerProfilePrefix(self):
+        return f"{self.profileFile}.worker.{os.getpid()}"
+
+    def _finishProfile(self):
+        import pstats
+        self.profiler.disable()
+        del os.environ[_workerProfileEnv]
+        stats = pstats.Stats(self.profiler)
+        for workerProfile in glob.glob(self._workerProfilePrefix() + ".*"):
+            stats.add(workerProfile)
+            os.unlink(workerProfile)
+        stats.dump_stats(self.profileFile)
+
+    def _writeTimings(self, ok):
+        global _gStageTimings
+        timings = {"program": os.path.basename(sys.argv[0]), "argv": sys.argv[1:],
+                   "status": "ok" if ok else "failed",
+                   "wallSec": time.perf_counter() - self.startWall, "cpuSec": _cpuSec() - self.startCpu,
+                   "maxRssMb": maxRssMbGet(),
+                   "stages": [s.toDict() for s in _gStageTimings]}
+        _gStageTimings = None
+        with open(self.timingsFile, 'w') as fh:
+            json.dump(timings, fh, indent=2)
+            fh.write('\n')
@@ -2,7 +2,8 @@
 Access to interproscan results in JSON format.
 """
 from collections import defaultdict
-from pycbio.tsv import TsvReader, TsvRow
+from pycbio.tsv import TsvReader
+from uniprotmap.instrument import timedStage
 from uniprotmap import annotIdFmt
 
 class InterproError(Exception):
@@ -32,8 +33,18 @@ _tsvTypeMap = {"sequence_length": int,
                "go": _parse_none_if_minus,
                "pathways": _parse_none_if_minus}
 
-class InterproAnnot(TsvRow):
-    """one interpro annotation record"""
+class InterproAnnot:
+    """one interpro annotation record.  If read with a subset of columns,
+    only those are attributes.  Columns can also be accessed with row[name]."""
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+    def __repr__(self):
+        return f"InterproAnnot({self.annotId})"
 
     def short(self):
         desc = f"{self.protein_accession}/{self.analysis}:"
@@ -42,24 +53,92 @@ class InterproAnnot(TsvRow):
         else:
             return f"{desc}: {self.signature_description}"
 
+class _InterproRowParser:
+    """rowClass for TsvReader that creates a dict of the selected columns"""
+    def __init__(self, columns):
+        self.colIdxs = tuple((col, _tsvColumns.index(col)) for col in columns)
+
+    def __call__(self, reader, row):
+        return {col: row[idx] for col, idx in self.colIdxs}
+
+def _projectColumns(columns, skipFailed):
+    "columns to read, in file order"
+    if columns is None:
+        return _tsvColumns
+    unknown = set(columns) - set(_tsvColumns)
+    if len(unknown) > 0:
+        raise InterproError(f"unknown InterProScan columns: {', '.join(sorted(unknown))}")
+    needed = set(columns) | {"protein_accession"}
+    if skipFailed:
+        needed.add("status")
+    return tuple(col for col in _tsvColumns if col in needed)
+
+def _interproShardReader(interproTsv, columns):
+    typeMap = {col: conv for col, conv in _tsvTypeMap.items() if col in columns}
+    return TsvReader(interproTsv, columns=_tsvColumns, typeMap=typeMap,
+                     rowClass=_InterproRowParser(columns))
+
+def _interproAnnotReader(interproTsvs, columns):
+    "read rows of all shards, assigning annotation ids"
+    nextIdxs = defaultdict(int)
+    for interproTsv in interproTsvs:
+        for fields in _interproShardReader(interproTsv, columns):
+            acc = fields["protein_accession"]
+            yield InterproAnnot(annotId=annotIdFmt(acc, nextIdxs[acc]), **fields)
+            nextIdxs[acc] += 1
+
+def _interproTsvsList(interproTsvs):
+    return (interproTsvs,) if isinstance(interproTsvs, str) else interproTsvs
+
+def _isSkipped(annot, skipFailed):
+    return skipFailed and not annot.status
+
+def interproAnnotGroupReader(interproTsvs, *, columns=None, skipFailed=False):
+    """Read InterProScan TSV results, yielding tuples of (protein_accession,
+    [InterproAnnot]).  The interproTsvs maybe a file name or a list of shards
+    that are read as if concatenated.  The rows of a protein must be adjacent.
+    If columns is specified, only those columns are parsed and included in
+    the records.  If skipFailed is True, rows without a true status are
+    dropped.  Annotation ids count all rows, so they are the same with or
+    without skipping."""
+    seenAccs = set()
+    acc = None
+    annots = []
+    for annot in _interproAnnotReader(_interproTsvsList(interproTsvs), _projectColumns(columns, skipFailed)):
+        if annot.protein_accession != acc:
+            if acc is not None:
+                yield acc, annots
+            acc = annot.protein_accession
+            if acc in seenAccs:
+                raise InterproError(f"InterProScan results are not grouped by protein, '{acc}' occurs in more than one group")
+            seenAccs.add(acc)
+            annots = []
+        if not _isSkipped(annot, skipFailed):
+            annots.append(annot)
+    if acc is not None:
+        yield acc, annots
 
 class InterproAnnotTbl(list):
     """InterProScan analysis results from TSV output.
 
     Rows have the above columns from TSV, plus
     annotId - computed annotId with protein id and offset within proteins annotations
+    Ids of rows that were skipped at load are in skippedAnnotIds.
     """
     def __init__(self):
         self.byAcc = defaultdict(list)
         self.byAnnotId = {}
+        self.skippedAnnotIds = set()
 
     def add(self, row):
         self.append(row)
         self.byAcc[row.protein_accession].append(row)
-        row.annotId = annotIdFmt(row.protein_accession, len(self.byAcc[row.protein_accession]) - 1)
         assert row.annotId not in self.byAnnotId
         self.byAnnotId[row.annotId] = row
 
+    def addSkipped(self, annotId):
+        self.skippedAnnotIds.add(annotId)
+
     def finish(self):
         self.byAcc.default_factory = None
 
@@ -71,17 +150,26 @@ class InterproAnnotTbl(list):
             raise InterproError(f"InterPro acc not found {acc}") from ex
 
     def getByAnnotId(self, annotId):
+        "Error if not found, None if skipped when loaded"
         annot = self.byAnnotId.get(annotId)
         if annot is None:
+            if annotId in self.skippedAnnotIds:
+                return None
             raise InterproError(f"InterPro annotId '{annotId}' not found in annotation table")
         return annot
 
-def interproAnnotsLoad(interproTsv):
-    """Load interproscan results TSV """
+def interproAnnotsLoad(interproTsvs, *, columns=None, skipFailed=False):
+    """Load interproscan results TSV, or a list of TSV shards.  If columns is
+    specified, only those columns are parsed.  If skipFailed is True, rows
+    without a true status are not kept and getByAnnotId returns None for them."""
 
     interproTbl = InterproAnnotTbl()
-    for row in TsvReader(interproTsv, columns=_tsvColumns, typeMap=_tsvTypeMap,
-                         rowClass=InterproAnnot):
-        interproTbl.add(row)
-    interproTbl.finish()
+    with timedStage("interproAnnotsLoad") as stage:
+        for annot in _interproAnnotReader(_interproTsvsList(interproTsvs), _projectColumns(columns, skipFailed)):
+            if _isSkipped(annot, skipFailed):
+                interproTbl.addSkipped(annot.annotId)
+            else:
+                interproTbl.add(annot)
+        interproTbl.finish()
+        stage.records = len(interproTbl)
     return interproTbl
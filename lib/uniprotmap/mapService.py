@@ -0,0 +1,271 @@
+"""
+Long running local service that holds the transcript alignments, UniProt
+tables and annotation mappings in memory, answering queries for alignments,
+mapped annotations and decorators without reloading the data for each one.
+Clients connect over a UNIX domain socket; each request and response is a
+single line of JSON.
+
+Requests are objects with an "op" and, except for the service ops, a
+selection of transcripts given by one of:
+   transIds: list of transcript ids
+   accs: list of UniProt accessions, selecting the transcripts with
+         annotations of these proteins and only those annotations
+   region: genomic range as chrom:start-end, selecting the transcripts
+           overlapping it
+
+The ops are:
+   transPsls: transcript genome alignments as PSL rows
+   annotPsls: mapped annotation genome alignments as PSL rows
+   annotRefs: annotation to transcript references as annot2GenomeRef rows
+   decorators: decorator BED rows
+   ping, stats: check the service and get counts of the loaded data
+   shutdown: stop the service
+
+Responses are {"status": "ok", "header": [...] or null, "rows": [...],
+"notFound": [...]}, with rows as tab-separated strings and notFound the
+requested transIds or accs with no data, or {"status": "error", "message": ...}.
+
+Each connection is handled in its own thread, so a client may keep a
+connection open for a session without blocking other clients.  The data is
+not changed after it is loaded, so requests run concurrently.
+The annotation mappings are read from the output of uniprotAnnotsMap,
+the service does not run pslMap.  Clients use mapServiceClient.
+"""
+import os
+import json
+import socket
+import socketserver
+import threading
+from collections import defaultdict
+from pycbio.hgdata.coords import Coords
+from uniprotmap import annotIdToProtAcc
+from uniprotmap.instrument import timedStage
+from uniprotmap.geneset import geneSetDataPslLoad
+from uniprotmap.uniprot import UniProtMetaTbl, UniProtAnnotTbl
+from uniprotmap.metadata import Annot2GenomeRefWriter
+from uniprotmap.annotMappings import transAnnotMappingLoader
+from uniprotmap.uniprotDecorators import AnnotationProcessor, DataSetMappings
+from uniprotmap.mapServiceClient import MapServiceError, dataOps, serviceOps
+
+_selectionKeys = ("transIds", "accs", "region")
+
+def _annotRefRow(annotRef):
+    return [("" if v is None else str(v)) for v in (getattr(annotRef, f) for f in Annot2GenomeRefWriter.header)]
+
+def _transSortKey(transAnnotMappings):
+    psl = transAnnotMappings.transPsl
+    return (psl.tName, psl.tStart, psl.tEnd, psl.qName)
+
+def _decoSortKey(decoBed):
+    return (decoBed.chrom, decoBed.chromStart, decoBed.chromEnd, decoBed.name)
+
+class MapServiceData:
+    """Data held in memory by the service for one UniProt dataset.  Mappings
+    are indexed by transcript id and by the protein accessions of their
+    annotations."""
+    def __init__(self, dataSetInputs, geneSetData, uniprotMetaTbl, annotMappingsTbl):
+        self.dataSet = dataSetInputs.dataSet
+        self.geneSetData = geneSetData
+        self.uniprotMetaTbl = uniprotMetaTbl
+        self.annotMappingsTbl = annotMappingsTbl
+        self.byAcc = self._buildAccIdx()
+        self.annotProc = AnnotationProcessor([dataSetInputs], uniprotMetaTbls=[uniprotMetaTbl])
+
+    def _buildAccIdx(self):
+        "both isoform and main isoform accessions are indexed"
+        byAcc = defaultdict(list)
+        for transAnnotMappings in self.annotMappingsTbl:
+            accs = set()
+            for annotMapping in transAnnotMappings.annotMappings:
+                accs.add(annotMapping.annot.acc)
+                accs.add(annotIdToProtAcc(annotMapping.annotRef.annotId))
+            for acc in accs:
+                byAcc[acc].append(transAnnotMappings)
+        byAcc.default_factory = None
+        return byAcc
+
+    def getStats(self):
+        return {"dataSet": str(self.dataSet),
+                "transcripts": len(self.geneSetData.entries),
+                "mappedTranscripts": len(self.annotMappingsTbl),
+                "annotMappings": sum(len(tam.annotMappings) for tam in self.annotMappingsTbl),
+                "accs": len(self.byAcc),
+                "uniprotEntries": len(self.uniprotMetaTbl)}
+
+def mapServiceDataLoad(trans2GenomePslFile, dataSetInputs, *, geneSetCacheDir=None):
+    "load the data for a service from the files for a dataset"
+    geneSetData = geneSetDataPslLoad(trans2GenomePslFile, cacheDir=geneSetCacheDir)
+    uniprotMetaTbl = UniProtMetaTbl(dataSetInputs.uniprotMetaTsv)
+    uniprotAnnotTbl = UniProtAnnotTbl(dataSetInputs.uniprotAnnotsTsv)
+    with timedStage("annotMappingsLoad") as stage:
+        annotMappingsTbl = transAnnotMappingLoader(dataSetInputs.annot2GenomePsl, dataSetInputs.annot2GenomeRefTsv,
+                                                   uniprotAnnotTbl.getByAnnotId, geneSetData.getAlign)
+        stage.records = len(annotMappingsTbl)
+    return MapServiceData(dataSetInputs, geneSetData, uniprotMetaTbl, annotMappingsTbl)
+
+class _Selection:
+    """transcripts selected by a request, as their alignments and
+    TransAnnotMappings, limited to the requested accessions"""
+    def __init__(self):
+        self.transPsls = []
+        self.transAnnotMappings = []
+        self.notFound = []
+
+def _selectTransIds(data, transIds):
+    sel = _Selection()
+    for transId in transIds:
+        entries = data.geneSetData.findEntries(transId)
+        if len(entries) == 0:
+            sel.notFound.append(transId)
+        sel.transPsls.extend(entry.psl for entry in entries)
+        sel.transAnnotMappings.extend(data.annotMappingsTbl.findEntries(transId))
+    return sel
+
+def _limitToAccs(transAnnotMappings, accs):
+    annotMappings = [am for am in transAnnotMappings.annotMappings
+                     if (am.annot.acc in accs) or (annotIdToProtAcc(am.annotRef.annotId) in accs)]
+    return transAnnotMappings._replace(annotMappings=annotMappings)
+
+def _selectAccs(data, accs):
+    sel = _Selection()
+    seen = set()
+    for acc in accs:
+        transAnnotMappingsList = data.byAcc.get(acc, ())
+        if len(transAnnotMappingsList) == 0:
+            sel.notFound.append(acc)
+        for transAnnotMappings in transAnnotMappingsList:
+            if id(transAnnotMappings) not in seen:
+                seen.add(id(transAnnotMappings))
+                sel.transAnnotMappings.append(transAnnotMappings)
+    accs = frozenset(accs)
+    sel.transAnnotMappings = [_limitToAccs(tam, accs) for tam in sel.transAnnotMappings]
+    sel.transPsls = [tam.transPsl for tam in sel.transAnnotMappings]
+    return sel
+
+def _selectRegion(data, region):
+    try:
+        coords = Coords.parse(region)
+    except Exception as ex:
+        raise MapServiceError(f"invalid region '{region}', expected chrom:start-end") from ex
+    sel = _Selection()
+    for entry in sorted(data.geneSetData.getOverEntries(coords.name, coords.start, coords.end),
+                        key=lambda e: (e.start, e.end, e.name)):
+        sel.transPsls.append(entry.psl)
+        transAnnotMappings = data.annotMappingsTbl.findEntry(entry.name, entry.chrom)
+        if transAnnotMappings is not None:
+            sel.transAnnotMappings.append(transAnnotMappings)
+    return sel
+
+def _select(data, request):
+    keys = [k for k in _selectionKeys if request.get(k) is not None]
+    if len(keys) != 1:
+        raise MapServiceError(f"request must specify exactly one of {', '.join(_selectionKeys)}")
+    if keys[0] == "transIds":
+        return _selectTransIds(data, request["transIds"])
+    elif keys[0] == "accs":
+        return _selectAccs(data, request["accs"])
+    else:
+        return _selectRegion(data, request["region"])
+
+class MapService:
+    "answers requests using the in-memory data"
+    def __init__(self, data):
+        self.data = data
+        self.stopping = False
+        self.numRequests = 0
+        self.countLock = threading.Lock()
+        self.opFuncs = {"transPsls": self._opTransPsls,
+                        "annotPsls": self._opAnnotPsls,
+                        "annotRefs": self._opAnnotRefs,
+                        "decorators": self._opDecorators}
+
+    def _opTransPsls(self, sel):
+        return None, ["\t".join(psl.toRow()) for psl in sel.transPsls]
+
+    def _opAnnotPsls(self, sel):
+        return None, ["\t".join(am.annotPsl.toRow())
+                      for tam in sel.transAnnotMappings for am in tam.annotMappings
+                      if am.annotPsl is not None]
+
+    def _opAnnotRefs(self, sel):
+        return Annot2GenomeRefWriter.header, ["\t".join(_annotRefRow(am.annotRef))
+                                              for tam in sel.transAnnotMappings for am in tam.annotMappings]
+
+    def _opDecorators(self, sel):
+        decoBeds = []
+        for transAnnotMappings in sorted(sel.transAnnotMappings, key=_transSortKey):
+            decoBeds.extend(self.data.annotProc.create(DataSetMappings(0, transAnnotMappings)))
+        decoBeds.sort(key=_decoSortKey)
+        return None, ["\t".join(decoBed.toRow()) for decoBed in decoBeds]
+
+    def _dataOp(self, op, request):
+        sel = _select(self.data, request)
+        header, rows = self.opFuncs[op](sel)
+        return {"status": "ok", "header": header, "rows": rows, "notFound": sel.notFound}
+
+    def _serviceOp(self, op):
+        if op == "shutdown":
+            self.stopping = True
+        response = {"status": "ok"}
+        if op == "stats":
+            response["stats"] = dict(self.data.getStats(), requests=self.numRequests)
+        return response
+
+    def _process(self, request):
+        if not isinstance(request, dict):
+            raise MapServiceError("request must be a JSON object")
+        op = request.get("op")
+        if op in serviceOps:
+            return self._serviceOp(op)
+        elif op in dataOps:
+            return self._dataOp(op, request)
+        else:
+            raise MapServiceError(f"invalid op '{op}', expected one of {', '.join(serviceOps + dataOps)}")
+
+    def dispatch(self, requestLine):
+        "process a request line, returning the response, errors are returned as responses"
+        with self.countLock:
+            self.numRequests += 1
+        try:
+            return self._process(json.loads(requestLine))
+        except Exception as ex:
+            return {"status": "error", "message": f"{type(ex).__name__}: {ex}"}
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    "handle requests on a connection until the client closes it"
+    def handle(self):
+        service = self.server.service
+        for requestLine in self.rfile:
+            response = service.dispatch(requestLine)
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+            if service.stopping:
+                self.server.shutdown()
+                break
+
+def mapServiceSocketPrepare(socketPath):
+    """Error if a service is listening on socketPath, otherwise remove it if it
+    exists.  Call before loading the data to fail early."""
+    if not os.path.exists(socketPath):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socketPath)
+        except ConnectionRefusedError:
+            os.unlink(socketPath)
+            return
+    raise MapServiceError(f"mapping service is already running on {socketPath}")
+
+class _MapServiceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    "connections still open at shutdown don't prevent the server from exiting"
+    daemon_threads = True
+
+def mapServiceRun(data, socketPath):
+    "serve requests on socketPath until a shutdown request"
+    service = MapService(data)
+    mapServiceSocketPrepare(socketPath)
+    with _MapServiceServer(socketPath, _RequestHandler) as server:
+        server.service = service
+        try:
+            server.serve_forever()
+        finally:
+            os.unlink(socketPath)
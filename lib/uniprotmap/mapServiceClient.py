@@ -0,0 +1,54 @@
+"""
+Client for the mapping service in mapService.  This is kept separate from
+the service so that clients don't import the mapping library.
+"""
+import json
+import socket
+
+class MapServiceError(Exception):
+    pass
+
+# ops that query data
+dataOps = ("transPsls", "annotPsls", "annotRefs", "decorators")
+
+# ops that don't take a selection
+serviceOps = ("ping", "stats", "shutdown")
+
+class MapServiceClient:
+    """Connection to a mapping service; requests raise MapServiceError
+    if the service returns an error."""
+    def __init__(self, socketPath):
+        self.socketPath = socketPath
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.sock.connect(socketPath)
+        except OSError as ex:
+            self.sock.close()
+            raise MapServiceError(f"can't connect to mapping service on {socketPath}: {ex}") from ex
+        self.rfile = self.sock.makefile('rb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def close(self):
+        if self.sock is not None:
+            self.rfile.close()
+            self.sock.close()
+            self.sock = self.rfile = None
+
+    def request(self, op, **params):
+        "send a request, returning the response"
+        request = {"op": op}
+        request.update({k: v for k, v in params.items() if v is not None})
+        self.sock.sendall(json.dumps(request).encode() + b'\n')
+        responseLine = self.rfile.readline()
+        if len(responseLine) == 0:
+            raise MapServiceError(f"mapping service on {self.socketPath} closed connection")
+        response = json.loads(responseLine)
+        if response["status"] != "ok":
+            raise MapServiceError(f"mapping service request '{op}' failed: {response['message']}")
+        return response
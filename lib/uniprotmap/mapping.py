@@ -3,9 +3,13 @@
 # and related
 ##
 from collections import defaultdict
+import shutil
 import pipettor
-from pycbio.tsv import TsvReader, strOrNoneType, intOrNoneType
-from pycbio.hgdata.psl import Psl, PslBlock, PslReader
+from pycbio.tsv import strOrNoneType, intOrNoneType
+from pycbio.hgdata.psl import Psl, PslBlock
+from uniprotmap.instrument import timedStage
+from uniprotmap.progress import progressIter
+from uniprotmap.compressedFiles import compressedOpen, compressedPslReader, compressedTsvReader, isCompressedFileName
 
 def pslMapMkCmd(inPslFile, mapPslFile, outPslFile, *, swapMap=False, outPslFileCopy=None, mapInfo=None,
                 interPrefix=None, interMid=None, chainMapFile=False):
@@ -69,8 +73,10 @@ class PslMapInfoTbl(list):
         # use (mappingQName, mappedTName) to handle PAR
         self.byMappingQMappedTNames = defaultdict(list)
         self.byMappedTName = defaultdict(list)
-        for row in TsvReader(mapInfoTsv, typeMap=_mapInfoTypeMap):
-            self._load_row(row)
+        with timedStage("PslMapInfoTbl") as stage:
+            for row in compressedTsvReader(mapInfoTsv, typeMap=_mapInfoTypeMap):
+                self._load_row(row)
+            stage.records = len(self)
         self.bySrcTName.default_factory = None
         self.byMappingQMappedTNames.default_factory = None
         self.byMappedTName.default_factory = None
@@ -85,7 +91,7 @@ class PslMapInfoTbl(list):
 def getQuerySizes(pslFile):
     """Get the sizes of all of queries in a PSL file."""
     querySizes = {}
-    for psl in PslReader(pslFile):
+    for psl in progressIter(compressedPslReader(pslFile), f"reading {pslFile}", unit="PSLs"):
         querySizes[psl.qName] = psl.qSize
     return querySizes
 
@@ -120,4 +126,9 @@ def pslMapAnnots(annotCanonPslFile, prot2TransPairedPslFile, trans2GenomePslFile
     # per-transcript annotation to genome mapping
     cmds += pslMapMkCmd("/dev/stdin", trans2GenomePslFile, "/dev/stdout", mapInfo=annotGenomeMapInfoTsv)
 
-    pipettor.run(cmds, stdout=annot2GenomePslFh)
+    with timedStage("pslMap"):
+        if isCompressedFileName(annot2GenomePslFh):
+            with pipettor.Popen(cmds, 'rb') as pslMapFh, compressedOpen(annot2GenomePslFh, 'wb') as outFh:
+                shutil.copyfileobj(pslMapFh, outFh, 1024 * 1024)
+        else:
+            pipettor.run(cmds, stdout=annot2GenomePslFh)
@@ -1,6 +1,7 @@
 """
 Analyze mappings of features to transcripts.
 """
+import bisect
 from collections import namedtuple
 from pycbio.sys.symEnum import SymEnum, auto
 
@@ -31,17 +32,30 @@ class FeatureIndel(namedtuple("FeatureIndel",
     is length of insert.  ranges can be zero length."""
     __slots__ = ()
 
-def _exonIntersections(transPsl, tStart, tEnd):
-    """return list of genome ranges where exons intersect the specified range.
-    If nothing is return, that indicates tStart/tEnd are exactly an exon.
-    """
-    exonIntersects = []
-    for iBlk in range(len(transPsl.blocks)):
-        start = max(tStart, transPsl.blocks[iBlk].tStart)
-        end = min(tEnd, transPsl.blocks[iBlk].tEnd)
-        if start < end:
-            exonIntersects.append((start, end))
-    return exonIntersects
+class TransExonIndex:
+    """Index of the exons of a transcript PSL for finding the exons
+    intersecting a range by binary search.  Build once per transcript and
+    use for all of its annotations."""
+    __slots__ = ("starts", "ends")
+
+    def __init__(self, transPsl):
+        # blocks are ascending and don't overlap, so both are sorted
+        self.starts = [blk.tStart for blk in transPsl.blocks]
+        self.ends = [blk.tEnd for blk in transPsl.blocks]
+
+    def intersections(self, tStart, tEnd):
+        """return list of genome ranges where exons intersect the specified range.
+        If nothing is return, that indicates tStart/tEnd are exactly an exon.
+        """
+        exonIntersects = []
+        iBlk = bisect.bisect_right(self.ends, tStart)
+        while (iBlk < len(self.starts)) and (self.starts[iBlk] < tEnd):
+            start = max(tStart, self.starts[iBlk])
+            end = min(tEnd, self.ends[iBlk])
+            if start < end:
+                exonIntersects.append((start, end))
+            iBlk += 1
+        return exonIntersects
 
 def _analyzeStart(annotPsl):
     if annotPsl.qStart > 0:
@@ -69,42 +83,82 @@ def _analyzeQDel(blk, nextBlk):
     yield FeatureIndel(FeatureIndelType.del_int, (nextBlk.qStart - blk.qEnd),
                        blk.tEnd, nextBlk.tStart)
 
-def _analyzeTDel(transPsl, blk, nextBlk):
+def _analyzeTDel(exonIndex, blk, nextBlk):
     # this excludes introns
-    for exStart, exEnd in _exonIntersections(transPsl, blk.tEnd, nextBlk.tStart):
+    for exStart, exEnd in exonIndex.intersections(blk.tEnd, nextBlk.tStart):
         yield FeatureIndel(FeatureIndelType.insert, (exEnd - exStart),
                            exStart, exEnd)
 
-def _analyzeBlock(transPsl, annotPsl, iBlk):
+def _analyzeBlock(exonIndex, annotPsl, iBlk):
     blk = annotPsl.blocks[iBlk]
     nextBlk = annotPsl.blocks[iBlk + 1]
     if blk.qEnd < nextBlk.qStart:
         yield from _analyzeQDel(blk, nextBlk)
 
     if blk.tEnd < nextBlk.tStart:
-        yield from _analyzeTDel(transPsl, blk, nextBlk)
+        yield from _analyzeTDel(exonIndex, blk, nextBlk)
 
-def _analyzeBlocks(transPsl, annotPsl):
+def _analyzeBlocks(exonIndex, annotPsl):
     for iBlk in range(len(annotPsl.blocks) - 1):
-        yield from _analyzeBlock(transPsl, annotPsl, iBlk)
+        yield from _analyzeBlock(exonIndex, annotPsl, iBlk)
 
-def _analyzePartialDeletion(transPsl, annotPsl):
+def _analyzePartialDeletion(exonIndex, annotPsl):
     yield from _analyzeStart(annotPsl)
-    yield from _analyzeBlocks(transPsl, annotPsl)
+    yield from _analyzeBlocks(exonIndex, annotPsl)
     yield from _analyzeEnd(annotPsl)
 
 def _analyzeFullDeletion(annotRef):
     yield FeatureIndel(FeatureIndelType.del_full, annotRef.annotSize, 0, 0)
 
-def _featureIndelGen(transPsl, annotMapping):
+def _featureIndelGen(exonIndex, annotMapping):
     if annotMapping.annotPsl is None:
         yield from _analyzeFullDeletion(annotMapping.annotRef)
     else:
-        yield from _analyzePartialDeletion(transPsl, annotMapping.annotPsl)
+        yield from _analyzePartialDeletion(exonIndex, annotMapping.annotPsl)
 
-def analyzeFeatureMapping(transAnnotMapping, annotMapping):
+def analyzeFeatureMapping(transAnnotMapping, annotMapping, *, exonIndex=None):
     """Product list of feature disruptions, either
     unmapped regions of feature or insertions in
     feature that don't correspond to introns in
-    transcripts. Empty list indicates no problems."""
-    return tuple(_featureIndelGen(transAnnotMapping.transPsl, annotMapping))
+    transcripts. Empty list indicates no problems.
+    An exonIndex for transAnnotMapping.transPsl is built if not supplied."""
+    if exonIndex is None:
+        exonIndex = TransExonIndex(transAnnotMapping.transPsl)
+    return tuple(_featureIndelGen(exonIndex, annotMapping))
+
+def analyzeFeatureMappings(transAnnotMapping, annotMappings=None):
+    """Analyze all annotMappings of a transcript, returning a tuple of
+    the analyzeFeatureMapping results, in the same order.  If annotMappings
+    is None, all of transAnnotMapping.annotMappings are analyzed."""
+    if annotMappings is None:
+        annotMappings = transAnnotMapping.annotMappings
+    exonIndex = TransExonIndex(transAnnotMapping.transPsl)
+    return tuple([tuple(_featureIndelGen(exonIndex, annotMapping))
+                  for annotMapping in annotMappings])
+
+###
+# Similarity of annotation alignments
+###
+def pslTOverlap(psl1, psl2):
+    """Number of target bases where the blocks of two PSLs overlap.  The blocks
+    of each are sorted and don't overlap, so they are merged in one pass."""
+    blks1, blks2 = psl1.blocks, psl2.blocks
+    overlapCnt = 0
+    i1 = i2 = 0
+    while (i1 < len(blks1)) and (i2 < len(blks2)):
+        blk1, blk2 = blks1[i1], blks2[i2]
+        maxStart = max(blk1.tStart, blk2.tStart)
+        minEnd = min(blk1.tEnd, blk2.tEnd)
+        if maxStart < minEnd:
+            overlapCnt += minEnd - maxStart
+        # advance the one that ends first
+        if blk1.tEnd <= blk2.tEnd:
+            i1 += 1
+        else:
+            i2 += 1
+    return overlapCnt
+
+def pslTSimilarity(psl1, psl2):
+    "similarity of two PSLs in the target (genome) space"
+    assert psl1.tStrand == psl2.tStrand
+    return (2 * pslTOverlap(psl1, psl2)) / (psl1.basesAligned() + psl2.basesAligned())
@@ -7,8 +7,9 @@ annotMapIds are in the form: <canon_acc>|<annot_idx>|<map_idx>
 from collections import defaultdict, namedtuple
 from pycbio.sys import fileOps
 from pycbio.hgdata.coords import Coords
-from pycbio.tsv import TsvReader, strOrNoneType, intOrNoneType
+from pycbio.tsv import strOrNoneType, intOrNoneType
 from uniprotmap import annotMapIdFmt, annotMapIdToAnnotId
+from uniprotmap.compressedFiles import compressedOpen, compressedTsvReader
 
 ###
 
@@ -53,7 +54,7 @@ class Annot2GenomeRefError(Exception):
     pass
 
 def annot2GenomeRefReader(annot2GenomeRefTsv):
-    return TsvReader(annot2GenomeRefTsv, typeMap=_annot2GenomeRefTypeMap, rowClass=_annot2GenomeRefParseRow)
+    return compressedTsvReader(annot2GenomeRefTsv, typeMap=_annot2GenomeRefTypeMap, rowClass=_annot2GenomeRefParseRow)
 
 class Annot2GenomeRefs:
     """look up transcript for a PSL row"""
@@ -76,8 +77,9 @@ class Annot2GenomeRefWriter:
     header = ["annotMapId", "annotSize", "transcriptPos", "transcriptId", "xspeciesSrcTransId", "alignIdx"]
 
     def __init__(self, annot2GenomeRefTsv):
-        self.fh = fileOps.opengz(annot2GenomeRefTsv, 'w')
+        self.fh = compressedOpen(annot2GenomeRefTsv, 'w')
         self.idxCounter = defaultdict(int)  # used to get globally unique id
+        self.numWritten = 0
         fileOps.prRow(self.fh, self.header)
 
     def __enter__(self):
@@ -100,6 +102,7 @@ class Annot2GenomeRefWriter:
         annotMapId = annotMapIdFmt(annotId, self.idxCounter[annotId])
         self.idxCounter[annotId] += 1
         fileOps.prRowv(self.fh, annotMapId, annotSize, transcriptPos, transcriptId, alignIdx, xspeciesSrcTransId)
+        self.numWritten += 1
 
 def xrefToItemArgs(annot2GenomeRef):
     "convert xref into into [name, start, end] for decorator"
@@ -0,0 +1,244 @@
+"""
+Run a workflow of stages, each either a command or a function, as a
+dependency graph.  Dependencies are found by matching stage inputs to the
+outputs of other stages.  Independent stages are run in parallel, in separate
+processes, within CPU, memory, and I/O budgets.
+
+Completion of a stage is recorded with uniprotmap.depends done files in a
+state directory, so a rerun resumes after the last successful stages and
+only reruns stages whose inputs, or upstream stages, have changed.
+"""
+import os
+from os import path as osp
+import time
+import multiprocessing as mp
+from multiprocessing.connection import wait
+import pipettor
+from uniprotmap import prMsg
+from uniprotmap.depends import runIfNotDone, getDoneFile
+
+class PipelineError(Exception):
+    pass
+
+class Stage:
+    """A step in the pipeline.  The action is either a command, as a list of
+    arguments or list of lists for a pipe, run with pipettor, or a function
+    that is called with args and kwargs.  Inputs and outputs are file
+    paths; directories for outputs are created. Resources used are the number of CPUs and approximate memory in
+    gigabytes.  Stages that put heavy load on shared file systems should set
+    ioHeavy, to limit how many run at once.
+
+    Params are included in the depends check when the pipeline compares by
+    content; commands are always included.
+    """
+    def __init__(self, name, action, *, args=(), kwargs=None, inputs=(), outputs=(),
+                 cpus=1, memGb=1.0, ioHeavy=False, params=None):
+        if not (callable(action) or isinstance(action, (list, tuple))):
+            raise PipelineError(f"stage '{name}' action must be a command or a function")
+        self.name = name
+        self.action = action
+        self.args = tuple(args)
+        self.kwargs = kwargs if kwargs is not None else {}
+        self.inputs = tuple(osp.normpath(p) for p in inputs)
+        self.outputs = tuple(osp.normpath(p) for p in outputs)
+        self.cpus = cpus
+        self.memGb = memGb
+        self.ioHeavy = ioHeavy
+        self.params = params
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def isCommand(self):
+        return not callable(self.action)
+
+    def dependsParams(self):
+        if self.isCommand:
+            return {"command": self.action, "params": self.params}
+        return self.params
+
+    def execute(self):
+        "run the stage in the current process"
+        if self.isCommand:
+            pipettor.run(self.action)
+        else:
+            self.action(*self.args, **self.kwargs)
+
+def _stageProcessMain(stage):
+    "entry point of stage process, exceptions result in a non-zero exit"
+    stage.execute()
+
+class _RunningStage:
+    def __init__(self, stage, doneCheck):
+        self.stage = stage
+        self.doneCheck = doneCheck
+        self.startTime = time.time()
+        for output in stage.outputs:
+            os.makedirs(osp.dirname(output) or ".", exist_ok=True)
+        self.proc = mp.Process(target=_stageProcessMain, args=(stage,), name=stage.name)
+        self.proc.start()
+
+    def finish(self):
+        "wait for process, returns True if successful"
+        self.proc.join()
+        ok = (self.proc.exitcode == 0)
+        if ok:
+            self.doneCheck.__exit__(None, None, None)
+        return ok
+
+class Pipeline:
+    """Dependency graph of stages.  The stateDir contains the done files,
+    and manifests when byContent is used, one per stage."""
+    def __init__(self, stateDir, *, byContent=False):
+        self.stateDir = stateDir
+        self.byContent = byContent
+        self.stages = {}
+        self.producers = {}
+
+    def add(self, stage):
+        "add a stage, which is returned"
+        if stage.name in self.stages:
+            raise PipelineError(f"duplicate stage name: {stage.name}")
+        for output in stage.outputs:
+            if output in self.producers:
+                raise PipelineError(f"output '{output}' of stage '{stage.name}' is also produced by stage '{self.producers[output]}'")
+        self.stages[stage.name] = stage
+        for output in stage.outputs:
+            self.producers[output] = stage
+        return stage
+
+    def getUpstream(self, stage):
+        "stages that produce inputs of stage, in order of inputs"
+        upstream = []
+        for inp in stage.inputs:
+            producer = self.producers.get(inp)
+            if (producer is not None) and (producer not in upstream):
+                upstream.append(producer)
+        return upstream
+
+    def _sortStages(self):
+        "topological sort, preserving order of addition where possible"
+        ordered = []
+        visiting = set()
+        visited = set()
+
+        def _visit(stage):
+            if stage.name in visited:
+                return
+            if stage.name in visiting:
+                raise PipelineError(f"dependency cycle involving stage '{stage.name}'")
+            visiting.add(stage.name)
+            for upstream in self.getUpstream(stage):
+                _visit(upstream)
+            visiting.remove(stage.name)
+            visited.add(stage.name)
+            ordered.append(stage)
+
+        for stage in self.stages.values():
+            _visit(stage)
+        return ordered
+
+    def _stageTarget(self, stage):
+        return osp.join(self.stateDir, stage.name)
+
+    def _doneCheck(self, stage):
+        """Returns an entered runIfNotDone for the stage.  Missing outputs
+        force the stage to be rerun."""
+        target = self._stageTarget(stage)
+        if not all(osp.exists(o) for o in stage.outputs):
+            doneFile = getDoneFile(target)
+            if osp.exists(doneFile):
+                os.unlink(doneFile)
+        doneCheck = runIfNotDone(target,
+                                 depends=[i for i in stage.inputs if i not in self.producers],
+                                 doneDepends=[self._stageTarget(u) for u in self.getUpstream(stage)],
+                                 byContent=self.byContent,
+                                 params=stage.dependsParams() if self.byContent else None)
+        doneCheck.__enter__()
+        return doneCheck
+
+    def run(self, *, maxCpus=None, maxMemGb=None, maxIoStages=None):
+        """Run out-of-date stages.  The limits are None for no limit,
+        except for maxCpus, which defaults to the number of CPUs.  A stage
+        that exceeds a limit is run when nothing else is running."""
+        os.makedirs(self.stateDir, exist_ok=True)
+        scheduler = _Scheduler(self, self._sortStages(),
+                               maxCpus if maxCpus is not None else os.cpu_count(),
+                               maxMemGb, maxIoStages)
+        scheduler.run()
+
+class _Scheduler:
+    "state of a pipeline run"
+    def __init__(self, pipeline, stages, maxCpus, maxMemGb, maxIoStages):
+        self.pipeline = pipeline
+        self.pending = list(stages)
+        self.maxCpus = maxCpus
+        self.maxMemGb = maxMemGb
+        self.maxIoStages = maxIoStages
+        self.running = {}  # by sentinel
+        self.doneChecks = {}  # by stage name, once ready
+        self.finished = set()
+        self.failed = []
+
+    def _isReady(self, stage):
+        return all(u.name in self.finished for u in self.pipeline.getUpstream(stage))
+
+    def _fits(self, stage):
+        if len(self.running) == 0:
+            return True
+        runStages = [r.stage for r in self.running.values()]
+        if sum(s.cpus for s in runStages) + stage.cpus > self.maxCpus:
+            return False
+        if (self.maxMemGb is not None) and (sum(s.memGb for s in runStages) + stage.memGb > self.maxMemGb):
+            return False
+        if stage.ioHeavy and (self.maxIoStages is not None) and (sum(1 for s in runStages if s.ioHeavy) >= self.maxIoStages):
+            return False
+        return True
+
+    def _startReady(self):
+        """start ready stages that fit, marking up-to-date ones as finished;
+        repeat as long as up-to-date stages make others ready"""
+        progress = True
+        while progress:
+            progress = False
+            for stage in list(self.pending):
+                if self._isReady(stage):
+                    doneCheck = self.doneChecks.get(stage.name)
+                    if doneCheck is None:
+                        doneCheck = self.doneChecks[stage.name] = self.pipeline._doneCheck(stage)
+                    if not doneCheck.outOfDate:
+                        prMsg(f"{stage.name}: up to date")
+                        doneCheck.__exit__(None, None, None)  # update manifest
+                        self.pending.remove(stage)
+                        self.finished.add(stage.name)
+                        progress = True
+                    elif self._fits(stage):
+                        prMsg(f"{stage.name}: starting")
+                        self.pending.remove(stage)
+                        running = _RunningStage(stage, doneCheck)
+                        self.running[running.proc.sentinel] = running
+
+    def _waitRunning(self):
+        for sentinel in wait(list(self.running.keys())):
+            running = self.running.pop(sentinel)
+            elapsed = time.time() - running.startTime
+            if running.finish():
+                prMsg(f"{running.stage.name}: finished in {elapsed:.1f} sec")
+                self.finished.add(running.stage.name)
+            else:
+                prMsg(f"{running.stage.name}: failed with exit code {running.proc.exitcode} after {elapsed:.1f} sec")
+                self.failed.append(running.stage)
+
+    def run(self):
+        while True:
+            if len(self.failed) == 0:
+                self._startReady()
+            if len(self.running) == 0:
+                break
+            self._waitRunning()
+        if len(self.failed) > 0:
+            raise PipelineError(f"pipeline stages failed: {' '.join(s.name for s in self.failed)}; "
+                                f"not run: {' '.join(s.name for s in self.pending)}")
+        if len(self.pending) > 0:
+            raise PipelineError(f"pipeline stages could not be run: {' '.join(s.name for s in self.pending)}")
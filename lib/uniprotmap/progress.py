@@ -0,0 +1,197 @@
+"""
+Progress reporting for long running loops.  When enabled, a background
+thread periodically reports the number of records processed, throughput,
+estimated time remaining and memory usage of each active loop to stderr
+and/or as JSON lines to a file.  A loop that has stopped making progress
+is reported as stalled, distinguishing a slow run from a hung one.
+
+Loops are instrumented with progressIter(), which returns the iterable
+unchanged when reporting is not enabled, or progressTrack() for loops
+that count records explicitly.  Reporting is only done in the process
+that enabled it, not in forked worker processes.
+"""
+import os
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+from uniprotmap.instrument import rssMbGet, maxRssMbGet
+
+class Progress:
+    """Progress of a loop; records are counted by calling update() or
+    incrementing count"""
+    __slots__ = ("name", "total", "unit", "count", "startTime",
+                 "lastTime", "lastCount", "lastChangeTime")
+
+    def __init__(self, name, total, unit):
+        self.name = name
+        self.total = total
+        self.unit = unit
+        self.count = 0
+        self.startTime = self.lastTime = self.lastChangeTime = time.monotonic()
+        self.lastCount = 0
+
+    def update(self, cnt=1):
+        self.count += cnt
+
+class _NullProgress:
+    "used when reporting is not enabled"
+    __slots__ = ()
+
+    def update(self, cnt=1):
+        pass
+
+_nullProgress = _NullProgress()
+
+def _fmtSecs(secs):
+    secs = int(secs)
+    return f"{secs // 3600}:{(secs // 60) % 60:02d}:{secs % 60:02d}"
+
+class _Reporter:
+    "background thread that reports on active loops"
+    def __init__(self, interval, toStderr, jsonFh):
+        self.interval = interval
+        self.toStderr = toStderr
+        self.jsonFh = jsonFh
+        self.pid = os.getpid()
+        self.active = []
+        self.lock = threading.Lock()
+        self.stopEvent = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="progress", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopEvent.set()
+        self.thread.join()
+
+    def _run(self):
+        while not self.stopEvent.wait(self.interval):
+            with self.lock:
+                for progress in self.active:
+                    self._report(progress, False)
+
+    def add(self, progress):
+        with self.lock:
+            self.active.append(progress)
+
+    def remove(self, progress):
+        with self.lock:
+            self.active.remove(progress)
+            self._report(progress, True)
+
+    def _report(self, progress, done):
+        "must be called with lock held"
+        now = time.monotonic()
+        count = progress.count  # may be changed by another thread
+        elapsedSec = now - progress.startTime
+        intervalSec = now - progress.lastTime
+        rate = (count - progress.lastCount) / intervalSec if intervalSec > 0 else 0.0
+        avgRate = count / elapsedSec if elapsedSec > 0 else 0.0
+        etaSec = None
+        if (progress.total is not None) and (avgRate > 0) and not done:
+            etaSec = max(progress.total - count, 0) / avgRate
+        if count != progress.lastCount:
+            progress.lastChangeTime = now
+        stalledSec = now - progress.lastChangeTime
+        progress.lastTime, progress.lastCount = now, count
+        rec = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "name": progress.name, "unit": progress.unit,
+               "count": count, "total": progress.total, "done": done,
+               "elapsedSec": elapsedSec, "rate": rate, "avgRate": avgRate, "etaSec": etaSec,
+               "stalledSec": stalledSec, "rssMb": rssMbGet(), "maxRssMb": maxRssMbGet()}
+        if self.toStderr:
+            print(self._fmtReport(rec), file=sys.stderr, flush=True)
+        if self.jsonFh is not None:
+            self.jsonFh.write(json.dumps(rec) + '\n')
+            self.jsonFh.flush()
+
+    def _fmtReport(self, rec):
+        msg = f"{rec['name']}: {rec['count']:,}"
+        if rec['total'] is not None:
+            pct = (100.0 * rec['count'] / rec['total']) if rec['total'] > 0 else 100.0
+            msg += f" of {rec['total']:,} ({pct:.1f}%)"
+        msg += f" {rec['unit']}"
+        if rec['done']:
+            msg += f", done in {_fmtSecs(rec['elapsedSec'])}, {rec['avgRate']:,.1f}/sec"
+        else:
+            msg += f", {rec['rate']:,.1f}/sec, elapsed {_fmtSecs(rec['elapsedSec'])}"
+            if rec['etaSec'] is not None:
+                msg += f", ETA {_fmtSecs(rec['etaSec'])}"
+            if rec['stalledSec'] >= 2 * self.interval:
+                msg += f", STALLED for {_fmtSecs(rec['stalledSec'])}"
+        if rec['rssMb'] is not None:
+            msg += f", RSS {rec['rssMb']:,.0f}MB"
+        return msg
+
+# _Reporter when enabled, otherwise None
+_gReporter = None
+
+def _getReporter():
+    if (_gReporter is None) or (_gReporter.pid != os.getpid()):
+        return None
+    return _gReporter
+
+def progressEnabled():
+    return _getReporter() is not None
+
+@contextmanager
+def progressTrack(name, *, total=None, unit="records"):
+    """Context manager returning a Progress object for a loop to update, or
+    an object that ignores updates if reporting is not enabled."""
+    reporter = _getReporter()
+    if reporter is None:
+        yield _nullProgress
+    else:
+        progress = Progress(name, total, unit)
+        reporter.add(progress)
+        try:
+            yield progress
+        finally:
+            reporter.remove(progress)
+
+def _progressIterGen(iterable, name, total, unit):
+    with progressTrack(name, total=total, unit=unit) as progress:
+        for item in iterable:
+            progress.count += 1
+            yield item
+
+def progressIter(iterable, name, *, total=None, unit="records"):
+    """Report progress on consuming iterable.  If total is None and the
+    iterable has a length, it is used as the total.  Returns iterable
+    unchanged if reporting is not enabled."""
+    if not progressEnabled():
+        return iterable
+    if (total is None) and hasattr(iterable, "__len__"):
+        total = len(iterable)
+    return _progressIterGen(iterable, name, total, unit)
+
+class ProgressReporting:
+    """Context manager that enables progress reporting every interval
+    seconds to stderr if toStderr is True, and as JSON lines to jsonFile if
+    it is not None.  Does nothing if neither is requested."""
+    def __init__(self, interval=30.0, *, toStderr=True, jsonFile=None):
+        self.interval = interval
+        self.toStderr = toStderr
+        self.jsonFile = jsonFile
+        self.jsonFh = None
+
+    def __enter__(self):
+        global _gReporter
+        if self.toStderr or (self.jsonFile is not None):
+            if self.jsonFile is not None:
+                self.jsonFh = open(self.jsonFile, 'w')
+            _gReporter = _Reporter(self.interval, self.toStderr, self.jsonFh)
+            _gReporter.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _gReporter
+        if _gReporter is not None:
+            _gReporter.stop()
+            _gReporter = None
+        if self.jsonFh is not None:
+            self.jsonFh.close()
+            self.jsonFh = None
+        return False
@@ -2,10 +2,13 @@
 Reads files create by uniprotToTab, and other uniport support
 """
 
+from array import array
 from collections import defaultdict
+from functools import cached_property
 from pycbio.sys.symEnum import SymEnum, auto
-from pycbio.tsv import TsvReader, TsvRow
-from uniprotmap import dropVersion, annotIdFmt
+from uniprotmap import dropVersion, annotIdFmt, annotIdParse
+from uniprotmap.instrument import timedStage
+from uniprotmap.compressedFiles import compressedTsvReader
 
 # WARNING: UniProt is 1-based, open-end
 
@@ -60,7 +63,7 @@ def addValuesToMultiIdx(idx, keys, value):
     for key in keys:
         idx[key].append(value)
 
-class UniProtMeta(TsvRow):
+class UniProtMeta:
     """one row record of UniProt metadata
 
     acc dataset mainIsoAcc orgName orgCommon taxonId name accList
@@ -69,44 +72,134 @@ class UniProtMeta(TsvRow):
     refSeqProt entrezGene ensemblGene ensemblProt ensemblTrans kegg emblMrna
     emblMrnaProt emblDna emblDnaProt pdb ec uniGene omimGene omimPhenotype
     subCellLoc functionText isoIds
+
+    If the table was loaded with a subset of columns, only those are
+    attributes.  The '|' separated list fields are split into frozensets
+    when first accessed.  Columns can also be accessed with row[name].
     """
 
-    def __init__(self, reader, row):
-        super().__init__(reader, row)
-        # split '|' separated list fields
-        self.geneNames = frozenset(splitMetaList(self.geneName))
-        self.ensemblGeneIds = frozenset(splitMetaList(self.ensemblGene))
-        self.ensemblGeneAccs = frozenset(splitDropVersion(self.ensemblGene))
-        self.ensemblTransIds = frozenset(splitMetaList(self.ensemblTrans))
-        self.ensemblTransAccs = frozenset(splitDropVersion(self.ensemblTrans))
-        self.otherIsoIds = frozenset(splitMetaList(self.isoIds))
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+    def __repr__(self):
+        return f"UniProtMeta({self.acc})"
+
+    @cached_property
+    def geneNames(self):
+        return frozenset(splitMetaList(self.geneName))
+
+    @cached_property
+    def ensemblGeneIds(self):
+        return frozenset(splitMetaList(self.ensemblGene))
+
+    @cached_property
+    def ensemblGeneAccs(self):
+        return frozenset(splitDropVersion(self.ensemblGene))
+
+    @cached_property
+    def ensemblTransIds(self):
+        return frozenset(splitMetaList(self.ensemblTrans))
+
+    @cached_property
+    def ensemblTransAccs(self):
+        return frozenset(splitDropVersion(self.ensemblTrans))
+
+    @cached_property
+    def otherIsoIds(self):
+        return frozenset(splitMetaList(self.isoIds))
 
     def isCanonProtTrans(self, transId):
         "does this UniProt reference this transcript?"
         return dropVersion(transId) in self.ensemblTransAccs
 
+# split list attributes and the column they are derived from
+_uniprotMetaSplitColumns = {
+    "geneNames": "geneName",
+    "ensemblGeneIds": "ensemblGene",
+    "ensemblGeneAccs": "ensemblGene",
+    "ensemblTransIds": "ensemblTrans",
+    "ensemblTransAccs": "ensemblTrans",
+    "otherIsoIds": "isoIds",
+}
+
+# always loaded, as they are needed by the table indexes
+_uniprotMetaIndexColumns = ("acc", "mainIsoAcc", "geneName", "ensemblGene", "ensemblTrans")
+
+# columns with few distinct values, which are interned
+_uniprotMetaInternColumns = frozenset(("dataset", "orgName", "orgCommon", "taxonId", "subCellLoc"))
+
+class _UniProtMetaRowParser:
+    """rowClass for TsvReader that creates UniProtMeta objects with a subset of
+    the columns, or all if columns is None"""
+    def __init__(self, columns):
+        self.columns = columns
+        self.colIdxs = None
+        self.interned = {}
+
+    def _setupColumns(self, reader):
+        columnMap = reader.columnSpecs.columnMap
+        if self.columns is None:
+            columns = columnMap.keys()
+        else:
+            columns = frozenset(_uniprotMetaIndexColumns + tuple(self.columns))
+        try:
+            self.colIdxs = tuple((col, columnMap[col]) for col in columns)
+        except KeyError as ex:
+            raise UniProtError(f"UniProt metadata column not found: {ex}") from ex
+
+    def _intern(self, value):
+        return self.interned.setdefault(value, value)
+
+    def __call__(self, reader, row):
+        if self.colIdxs is None:
+            self._setupColumns(reader)
+        return UniProtMeta(**{col: (self._intern(row[idx]) if col in _uniprotMetaInternColumns else row[idx])
+                              for col, idx in self.colIdxs})
 
 class UniProtMetaTbl(list):
-    """reads swissprot.9606.tab, trembl.9606.tab"""
-    def __init__(self, uniprotMetaTsv):
+    """reads swissprot.9606.tab, trembl.9606.tab
+
+    If columns is specified, only those columns are loaded along with the
+    ones needed to index the table.  Split list attributes, such as
+    ensemblTransAccs, maybe specified for the column they are derived from.
+    The gene name, gene and transcript indexes are built when first used.
+    """
+    def __init__(self, uniprotMetaTsv, *, columns=None):
         self.byAcc = {}
         self.byMainIsoAcc = {}
-        self.byGeneName = defaultdict(list)
-        self.byGeneAcc = defaultdict(list)
-        self.byTranscriptAcc = defaultdict(list)
-        for row in TsvReader(uniprotMetaTsv, rowClass=UniProtMeta):
-            self._readRow(row)
-        self.byGeneName.default_factory = None
-        self.byGeneAcc.default_factory = None
-        self.byTranscriptAcc.default_factory = None
+        if columns is not None:
+            columns = [_uniprotMetaSplitColumns.get(col, col) for col in columns]
+        with timedStage("UniProtMetaTbl") as stage:
+            for row in compressedTsvReader(uniprotMetaTsv, rowClass=_UniProtMetaRowParser(columns)):
+                self._readRow(row)
+            stage.records = len(self)
 
     def _readRow(self, row):
         self.append(row)
         addUniqueToIdx(self.byAcc, row.acc, row)
         addUniqueToIdx(self.byMainIsoAcc, row.mainIsoAcc, row)
-        self.byGeneName[row.geneName].append(row)
-        addValuesToMultiIdx(self.byGeneAcc, row.ensemblGeneAccs, row)
-        addValuesToMultiIdx(self.byTranscriptAcc, row.ensemblTransAccs, row)
+
+    def _buildMultiIdx(self, keysFunc):
+        idx = defaultdict(list)
+        for row in self:
+            addValuesToMultiIdx(idx, keysFunc(row), row)
+        idx.default_factory = None
+        return idx
+
+    @cached_property
+    def byGeneName(self):
+        return self._buildMultiIdx(lambda row: (row.geneName,))
+
+    @cached_property
+    def byGeneAcc(self):
+        return self._buildMultiIdx(lambda row: row.ensemblGeneAccs)
+
+    @cached_property
+    def byTranscriptAcc(self):
+        return self._buildMultiIdx(lambda row: row.ensemblTransAccs)
 
     def getByAcc(self, acc):
         "Error if not found"
@@ -146,8 +239,32 @@ class UniProtMetaTbl(list):
         return frozenset([dropVersion(transId) for transId in self.byTranscriptAcc.keys()])
 
 
-class UniprotAnnot(TsvRow):
-    """one interpro annotation record"""
+_uniprotAnnotColumns = ("acc", "mainIsoAcc", "varId", "featType", "shortFeatType", "begin", "end",
+                        "origAa", "mutAa", "dbSnpId", "disRelated", "disease", "disCode", "pmid",
+                        "longName", "shortName", "syns", "subCellLoc", "comment")
+_uniprotAnnotIntColumns = frozenset(("begin", "end"))
+
+class UniprotAnnot:
+    """one UniProt annotation record, created from the columns of a UniProtAnnotTbl.
+    Columns can also be accessed with row[name]."""
+    __slots__ = _uniprotAnnotColumns + ("annotId",)
+
+    def __init__(self, annotId, values):
+        self.annotId = annotId
+        for col, value in zip(_uniprotAnnotColumns, values):
+            setattr(self, col, value)
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+    def __getstate__(self):
+        return (self.annotId, tuple(getattr(self, col) for col in _uniprotAnnotColumns))
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def __repr__(self):
+        return f"UniprotAnnot({self.annotId})"
 
     def short(self):
         desc = f"{self.acc}: {self.shortFeatType}"
@@ -155,31 +272,140 @@ class UniprotAnnot(TsvRow):
             desc += f"/{self.comment}"
         return desc
 
-
-class UniProtAnnotTbl(list):
+class _CategoricalColumn:
+    """string column stored as an array of codes into a list of the distinct values"""
+    __slots__ = ("values", "codes", "codeMap")
+
+    def __init__(self):
+        self.values = []
+        self.codes = array('I')
+        self.codeMap = {}
+
+    def append(self, value):
+        code = self.codeMap.get(value)
+        if code is None:
+            code = self.codeMap[value] = len(self.values)
+            self.values.append(value)
+        self.codes.append(code)
+
+    def finish(self):
+        "the code map is only needed when loading"
+        self.codeMap = None
+
+    def __getitem__(self, iRow):
+        return self.values[self.codes[iRow]]
+
+def _uniprotAnnotParseRow(reader, row):
+    "rowClass for TsvReader that returns the values in _uniprotAnnotColumns order"
+    columnMap = reader.columnSpecs.columnMap
+    try:
+        return tuple(row[columnMap[col]] for col in _uniprotAnnotColumns)
+    except KeyError as ex:
+        raise UniProtError(f"UniProt annotations column not found: {ex}") from ex
+
+class UniProtAnnotTbl:
     """reads swissprot.9606.annots.tab or trembl.9606.annots.tab
 
     acc mainIsoAcc varId featType shortFeatType begin end origAa mutAa dbSnpId
     disRelated disease disCode pmid longName shortName syns subCellLoc comment
+
+    Stored by column, with strings as categorical columns and begin and
+    end in integer arrays.  Annotations are identified by the index of the
+    main isoform accession and the index of the feature within that
+    accession.  UniprotAnnot objects are created on access.
     """
     def __init__(self, uniprotAnnotsTsv):
-        self.byAnnotId = {}
-        self.byMainIsoAcc = defaultdict(list)
-        nextFeatId = defaultdict(int)
-        for row in TsvReader(uniprotAnnotsTsv, typeMap={"begin": int, "end": int},
-                             rowClass=UniprotAnnot):
-            self._readRow(row, nextFeatId)
-
-    def _readRow(self, row, nextFeatId):
-        annotId = annotIdFmt(row.mainIsoAcc, nextFeatId[row.mainIsoAcc])
-        nextFeatId[row.mainIsoAcc] += 1
-        row.annotId = annotId
-        self.append(row)
-        self.byAnnotId[annotId] = row
-        self.byMainIsoAcc[row.mainIsoAcc].append(row)
+        self.columns = {col: (array('i') if col in _uniprotAnnotIntColumns else _CategoricalColumn())
+                        for col in _uniprotAnnotColumns}
+        self.mainIsoAccs = []
+        self.mainIsoAccIdxs = {}
+        self.rowAccIdxs = array('I')
+        self.rowFeatIdxs = array('I')
+        self.accRows = []  # by accession index, rows indexes in feature order
+        with timedStage("UniProtAnnotTbl") as stage:
+            for values in compressedTsvReader(uniprotAnnotsTsv, typeMap={"begin": int, "end": int},
+                                              rowClass=_uniprotAnnotParseRow):
+                self._readRow(values)
+            for column in self.columns.values():
+                if isinstance(column, _CategoricalColumn):
+                    column.finish()
+            stage.records = len(self)
+
+    def _obtainAccIdx(self, mainIsoAcc):
+        accIdx = self.mainIsoAccIdxs.get(mainIsoAcc)
+        if accIdx is None:
+            accIdx = self.mainIsoAccIdxs[mainIsoAcc] = len(self.mainIsoAccs)
+            self.mainIsoAccs.append(mainIsoAcc)
+            self.accRows.append(array('I'))
+        return accIdx
+
+    def _readRow(self, values):
+        iRow = len(self.rowAccIdxs)
+        for column, value in zip(self.columns.values(), values):
+            column.append(value)
+        accIdx = self._obtainAccIdx(values[1])
+        self.rowAccIdxs.append(accIdx)
+        self.rowFeatIdxs.append(len(self.accRows[accIdx]))
+        self.accRows[accIdx].append(iRow)
+
+    def __len__(self):
+        return len(self.rowAccIdxs)
+
+    def __iter__(self):
+        for iRow in range(len(self)):
+            yield self._getRow(iRow)
+
+    def __getitem__(self, iRow):
+        if not (0 <= iRow < len(self)):
+            raise IndexError(f"UniProtAnnotTbl index out of range: {iRow}")
+        return self._getRow(iRow)
+
+    def _getRow(self, iRow):
+        annotId = annotIdFmt(self.mainIsoAccs[self.rowAccIdxs[iRow]], self.rowFeatIdxs[iRow])
+        return UniprotAnnot(annotId, [column[iRow] for column in self.columns.values()])
+
+    def getAnnotKey(self, annotId):
+        "(accession index, feature index) for an annotation id, or None if not in table"
+        mainIsoAcc, featIdx = annotIdParse(annotId)
+        accIdx = self.mainIsoAccIdxs.get(mainIsoAcc)
+        if (accIdx is None) or (featIdx >= len(self.accRows[accIdx])):
+            return None
+        return accIdx, featIdx
+
+    def getByAnnotKey(self, annotKey):
+        accIdx, featIdx = annotKey
+        return self._getRow(self.accRows[accIdx][featIdx])
 
     def getByAnnotId(self, annotId):
-        annot = self.byAnnotId.get(annotId)
-        if annot is None:
+        annotKey = self.getAnnotKey(annotId)
+        if annotKey is None:
             raise UniProtError(f"UniProt annotId '{annotId}' not found in annotation table")
-        return annot
+        return self.getByAnnotKey(annotKey)
+
+    def getByMainIsoAcc(self, mainIsoAcc):
+        "list of annotations for a main isoform accession, empty if none"
+        accIdx = self.mainIsoAccIdxs.get(mainIsoAcc)
+        if accIdx is None:
+            return []
+        return [self._getRow(iRow) for iRow in self.accRows[accIdx]]
+
+def uniprotAnnotGroupReader(uniprotAnnotsTsv):
+    """Read swissprot.9606.annots.tab or trembl.9606.annots.tab, which must be
+    grouped by mainIsoAcc, yielding tuples of (mainIsoAcc, [UniprotAnnot]).
+    Annotation ids are the same as assigned by UniProtAnnotTbl."""
+    seenAccs = set()
+    mainIsoAcc = None
+    annots = []
+    for values in compressedTsvReader(uniprotAnnotsTsv, typeMap={"begin": int, "end": int},
+                                      rowClass=_uniprotAnnotParseRow):
+        if values[1] != mainIsoAcc:
+            if len(annots) > 0:
+                yield mainIsoAcc, annots
+            mainIsoAcc = values[1]
+            if mainIsoAcc in seenAccs:
+                raise UniProtError(f"UniProt annotations are not grouped by mainIsoAcc, '{mainIsoAcc}' occurs in more than one group: {uniprotAnnotsTsv}")
+            seenAccs.add(mainIsoAcc)
+            annots = []
+        annots.append(UniprotAnnot(annotIdFmt(mainIsoAcc, len(annots)), values))
+    if len(annots) > 0:
+        yield mainIsoAcc, annots
@@ -2,14 +2,17 @@
 Support for creating UniProt decorators
 """
 
+from collections import namedtuple
 from pycbio.sys.svgcolors import SvgColors
 from pycbio.sys.color import Color
 from pycbio.sys.symEnum import SymEnum, auto
 from uniprotmap import dropVersion
-from uniprotmap.uniprot import UniProtCategory, UniProtDataSet, TransCategory
-from uniprotmap.mappingAnalysis import FeatureIndelType
+from uniprotmap.uniprot import UniProtError, UniProtCategory, UniProtDataSet, TransCategory, UniProtMetaTbl, UniProtAnnotTbl
+from uniprotmap.mappingAnalysis import FeatureIndelType, analyzeFeatureMappings, getFeatureIndelText
+from uniprotmap.metadata import xrefToItemArgs
+from uniprotmap.annotMappings import transAnnotMappingReader
 from pycbio.hgdata.bed import encodeRow
-from pycbio.hgdata.decoration import Decoration
+from pycbio.hgdata.decoration import Decoration, BedBlock, Glyph
 
 def makeColorDesc(color, info):
     colorName = SvgColors.getClosestName(color)
@@ -28,11 +31,6 @@ def isVariant(annot):
     return annot.featType == "sequence variant"
 
 
-###
-# Color logic.  This mostly matches UniProt genomic track, however colors for
-# overlay are not visible with track colors, so these are adjusted.
-###
-
 def _mkcolor(r, g, b, a=None):
     return Color.fromRgb8(r, g, b, a)
 
@@ -44,67 +42,9 @@ FEAT_DELETION_COLOR = _mkcolor(255, 0, 0)                  # red
 SWISSPCOLOR = _mkcolor(34, 139, 34)    # forestgreen, genomic tracks are 12,12,120 dark blue
 TREMBLCOLOR = _mkcolor(143, 188, 143)  # darkseagreen, genomic tracks are 0,150,250 light blue
 
-# mapping of annotations columns to colors
-featTypeColors = {
-    "modified residue": _mkcolor(255, 215, 0),            # gold
-    "glycosylation site": _mkcolor(0, 100, 100),          # teal
-    "disulfide bond": _mkcolor(100, 100, 100),            # dimgray
-    "topological domain": _mkcolor(100, 0, 0),            # maroon
-    "zinc finger region": _mkcolor(100, 100, 0),          # olive
-    "transmembrane region": _mkcolor(0, 150, 0),          # green
-    "signal peptide": _mkcolor(255, 0, 150),              # deeppink
-    "lipid moiety-binding region": _mkcolor(12, 12, 120)  # navy
-}
-shortFeatTypeColors = {
-    "phos": _mkcolor(200, 200, 0),        # goldenrod
-}
-commentColor = {
-    "Extracellular": _mkcolor(0, 110, 180),  # darkcyan
-    "Cytoplasmic": _mkcolor(255, 150, 0),    # darkorange
-}
-
-# TrEMBL categories to provide special coloring
-_tremblColorCategories = frozenset((
-    UniProtCategory.LocSignal,
-    UniProtCategory.LocExtra,
-    UniProtCategory.LocTransMemb,
-    UniProtCategory.LocCytopl,
-))
-
-def getFeatTypeColor(annot):
-    "by feature or short feature type"
-    color = featTypeColors.get(annot.featType, None)
-    if color is None:
-        color = shortFeatTypeColors.get(annot.shortFeatType, None)
-    return color
-
-def getAnnotColorSwissport(annot):
-    color = commentColor.get(annot.comment, None)
-    if color is None:
-        color = getFeatTypeColor(annot)
-    return color if color is not None else SWISSPCOLOR
-
-def getAnnotColorTrembl(annot):
-    if getAnnotCategory(annot)[0] in _tremblColorCategories:
-        return getAnnotColorSwissport(annot)
-    else:
-        return TREMBLCOLOR
-
-def getAnnotColor(annot, dataSet):
-    if dataSet == UniProtDataSet.SwissProt:
-        return getAnnotColorSwissport(annot)
-    else:
-        return getAnnotColorTrembl(annot)
-
 def getProblemColor(annot, isTrembl):
     return SvgColors.red
 
-# some feature types should not go into the bed name field.
-# for these features, we use the 'comment' as the bed name
-# e.g. "region of interest" is not very interesting, the actual
-# description is usually much more interesting.
-useCommentFeatType = frozenset(["domain", "chain", "region of interest", "topological domain", "short sequence motif"])
-
 # some very common disease codes are not in the diseases.txt file
 disShortNames = {
     "hepatocellular carcinoma": "HepatocC",
@@ -144,6 +84,13 @@ def getVarationBedName(annot):
         name = "%daa to %daa" % (len(annot.origAa), len(annot.mutAa))
     return name
 
+def getMutationBedName(annot):
+    "set the bed name field to a disease or to the mutation"
+    if (annot.origAa == ""):
+        return getDiseaseBedName(annot)
+    else:
+        return getVarationBedName(annot)
+
 def makeChainRangeName(annot):
     "trembl doesn't have comments for chains so make one up"
     # NOT USED FOR DECORATORS
@@ -161,53 +108,258 @@ def getCommentBedName(annot):
         name = "Disordered"
     return name
 
-def getAnnotDescriptiveName(annot):   # noqa:C901
-    "get name to use in BED, based on doUniprot"
-    # set the bed name field to a disease, to the mutation or something else
-    if (isMutagenesis(annot) or isVariant(annot)):
-        if (annot.origAa == ""):
-            return getDiseaseBedName(annot)
+def _replaceCommentName(old, new):
+    "name function that edits the comment"
+    return lambda annot: annot.comment.replace(old, new)
+
+def _cleavageCommentName(annot):
+    return "Cleave:" + annot.comment.split()[-1]
+
+###
+# Annotation rules table.  This is the one place where the rules for
+# category, descriptive name and color of an annotation are defined, which
+# makes it easier to keep in sync with doUniprot.  The table is compiled once
+# into dictionaries by field value and a trie of comment prefixes.
+###
+
+class AnnotRule(namedtuple("AnnotRule",
+                           ("field", "value", "category", "descName", "color"))):
+    """Rule for annotations where the field (featType, shortFeatType, or
+    comment) exactly matches value.  The category is a UniProtCategory,
+    descName is either a string or a function called with the annotation, and
+    color is a Color.  Any of these can be None if the rule doesn't define it.
+
+    When more than one rule matches, the name is taken from the featType,
+    then shortFeatType and then comment rules; the color from comment,
+    featType and then shortFeatType rules.  Categories are picked by the
+    order of UniProtCategory, which matches the precedence of the UniProt track.
+    """
+    __slots__ = ()
+
+    def __new__(cls, field, value, *, category=None, descName=None, color=None):
+        return super(AnnotRule, cls).__new__(cls, field, value, category, descName, color)
+
+class AnnotPrefixRule(namedtuple("AnnotPrefixRule",
+                                 ("prefix", "descName"))):
+    """Rule for the descriptive name of annotations with a comment starting
+    with prefix.  These are only used if no AnnotRule supplied a name.
+    Prefixes may not be a prefix of another rule's prefix."""
+    __slots__ = ()
+
+_categoryNames = {
+    UniProtCategory.Mut: "Mutation",
+    UniProtCategory.Splice: "Splice variant",
+    UniProtCategory.Struct: "Protein Structure",
+    # suggested by Regeneron: create four subtracks, for the subcell. localization indicators
+    UniProtCategory.LocTransMemb: "Transmembrane Domain",
+    UniProtCategory.LocExtra: "Extracellular Domain",
+    UniProtCategory.LocCytopl: "Cytoplasmic Domains",
+    UniProtCategory.LocSignal: "Signal Peptide",
+    UniProtCategory.Chain: "Polypeptide Chains",
+    UniProtCategory.Repeat: "Repeat",
+    UniProtCategory.Conflict: "Sequence Conflict",
+    UniProtCategory.DisulfBond: "Disulfide Bond",
+    UniProtCategory.Domain: "Domain",
+    UniProtCategory.Modif: "Amino Acid Modification",
+    UniProtCategory.Interest: "Region of Interest",
+    UniProtCategory.Other: "Other Annotation",
+}
+_otherCategory = (UniProtCategory.Other, _categoryNames[UniProtCategory.Other])
+
+# Some feature types should not go into the bed name field. For these
+# features, we use the 'comment' as the bed name.  e.g. "region of interest"
+# is not very interesting, the actual description is usually much more
+# interesting.  Order of colored rules is the order reported by getColorUses.
+annotRules = (
+    AnnotRule("featType", "mutagenesis site", category=UniProtCategory.Mut, descName=getMutationBedName),
+    AnnotRule("featType", "sequence variant", category=UniProtCategory.Mut, descName=getMutationBedName),
+    AnnotRule("featType", "splice variant", category=UniProtCategory.Splice),
+    AnnotRule("featType", "strand", category=UniProtCategory.Struct),
+    AnnotRule("featType", "helix", category=UniProtCategory.Struct),
+    AnnotRule("featType", "coiled-coil region", category=UniProtCategory.Struct),
+    AnnotRule("featType", "turn", category=UniProtCategory.Struct),
+    AnnotRule("featType", "modified residue", category=UniProtCategory.Modif,
+              color=_mkcolor(255, 215, 0)),            # gold
+    AnnotRule("featType", "glycosylation site", category=UniProtCategory.Modif,
+              color=_mkcolor(0, 100, 100)),            # teal
+    AnnotRule("featType", "disulfide bond", category=UniProtCategory.DisulfBond,
+              color=_mkcolor(100, 100, 100)),          # dimgray
+    AnnotRule("featType", "topological domain", category=UniProtCategory.Domain, descName=getCommentBedName,
+              color=_mkcolor(100, 0, 0)),              # maroon
+    AnnotRule("featType", "zinc finger region", category=UniProtCategory.Domain,
+              color=_mkcolor(100, 100, 0)),            # olive
+    AnnotRule("featType", "transmembrane region", category=UniProtCategory.LocTransMemb, descName="Transmembrane",
+              color=_mkcolor(0, 150, 0)),              # green
+    AnnotRule("featType", "signal peptide", category=UniProtCategory.LocSignal, descName="Signal peptide",
+              color=_mkcolor(255, 0, 150)),            # deeppink
+    AnnotRule("featType", "lipid moiety-binding region", category=UniProtCategory.Modif, descName="Lipidation",
+              color=_mkcolor(12, 12, 120)),            # navy
+    AnnotRule("featType", "phosphorylation site", category=UniProtCategory.Modif),
+    AnnotRule("featType", "chain", category=UniProtCategory.Chain, descName=getCommentBedName),
+    AnnotRule("featType", "repeat", category=UniProtCategory.Repeat),
+    AnnotRule("featType", "sequence conflict", category=UniProtCategory.Conflict),
+    AnnotRule("featType", "domain", category=UniProtCategory.Domain, descName=getCommentBedName),
+    AnnotRule("featType", "region of interest", category=UniProtCategory.Interest, descName=getCommentBedName),
+    AnnotRule("featType", "short sequence motif", descName=getCommentBedName),
+    AnnotRule("shortFeatType", "phos", descName="Phosphorylation",
+              color=_mkcolor(200, 200, 0)),            # goldenrod
+    AnnotRule("comment", "Extracellular", category=UniProtCategory.LocExtra,
+              color=_mkcolor(0, 110, 180)),            # darkcyan
+    AnnotRule("comment", "Cytoplasmic", category=UniProtCategory.LocCytopl,
+              color=_mkcolor(255, 150, 0)),            # darkorange
+    AnnotRule("comment", "Nuclear localization signal", descName="Nuclear loc"),
+    AnnotRule("comment", "Involved in receptor recognition and/or post-binding events", descName="Recept recog"),
+    AnnotRule("comment", "Fibronectin type-III", descName="FibronectIII"),
+    AnnotRule("comment", "Receptor-binding motif; binding to human ACE2", descName="binds ACE2"),
+)
+
+annotPrefixRules = (
+    AnnotPrefixRule("Zinc finger protein ", _replaceCommentName("Zinc finger protein ", "ZF-")),
+    AnnotPrefixRule("Necessary for the", _replaceCommentName("Necessary for the ", "")),
+    AnnotPrefixRule("Interaction with ", _replaceCommentName("Interaction with ", "Int:")),
+    AnnotPrefixRule("Involved in the", _replaceCommentName("Involved in the ", "")),
+    AnnotPrefixRule("Required for ", _replaceCommentName("Required for ", "")),
+    AnnotPrefixRule("Cleavage; by host ", _cleavageCommentName),
+)
+
+_annotRuleFields = ("featType", "shortFeatType", "comment")
+
+def _addRuleValue(idx, rule, value):
+    if rule.value in idx:
+        raise UniProtError(f"duplicate annotation rule for {rule.field} '{rule.value}'")
+    idx[rule.value] = value
+
+def _prefixTrieAdd(trie, prefixRule):
+    node = trie
+    for c in prefixRule.prefix:
+        if None in node:
+            raise UniProtError(f"annotation prefix rule '{prefixRule.prefix}' overlaps another prefix")
+        node = node.setdefault(c, {})
+    if len(node) > 0:
+        raise UniProtError(f"annotation prefix rule '{prefixRule.prefix}' overlaps another prefix")
+    node[None] = prefixRule
+
+def _prefixTrieFind(trie, text):
+    "find the rule with a prefix of text, or None; key of None marks the end of a prefix"
+    node = trie
+    for c in text:
+        node = node.get(c)
+        if node is None:
+            return None
+        if None in node:
+            return node[None]
+    return None
+
+class AnnotRulesTbl:
+    """Annotation rules compiled into lookup tables.  The categories are
+    stored as (rank, (category, categoryName)) to resolve featType
+    and comment rules by the precedence of the category."""
+
+    def __init__(self, rules, prefixRules):
+        self.categories = {f: {} for f in _annotRuleFields}
+        self.descNames = {f: {} for f in _annotRuleFields}
+        self.colors = {f: {} for f in _annotRuleFields}
+        self.commentPrefixes = {}
+        for rule in rules:
+            self._addRule(rule)
+        for prefixRule in prefixRules:
+            _prefixTrieAdd(self.commentPrefixes, prefixRule)
+        # hoist out of dict for speed
+        self.featTypeCategories = self.categories["featType"]
+        self.commentCategories = self.categories["comment"]
+        self.featTypeNames = self.descNames["featType"]
+        self.shortFeatTypeNames = self.descNames["shortFeatType"]
+        self.commentNames = self.descNames["comment"]
+
+    def _addRule(self, rule):
+        if rule.category is not None:
+            _addRuleValue(self.categories[rule.field], rule,
+                          (rule.category.value, (rule.category, _categoryNames[rule.category])))
+        if rule.descName is not None:
+            _addRuleValue(self.descNames[rule.field], rule, rule.descName)
+        if rule.color is not None:
+            _addRuleValue(self.colors[rule.field], rule, rule.color)
+
+    def getCategory(self, annot):
+        featTypeCat = self.featTypeCategories.get(annot.featType)
+        commentCat = self.commentCategories.get(annot.comment)
+        if commentCat is None:
+            return featTypeCat[1] if featTypeCat is not None else _otherCategory
+        elif (featTypeCat is None) or (commentCat[0] < featTypeCat[0]):
+            return commentCat[1]
         else:
-            return getVarationBedName(annot)
-    if annot.featType in useCommentFeatType:
-        return getCommentBedName(annot)
-    if annot.featType == "signal peptide":
-        return "Signal peptide"
-    if annot.featType == "lipid moiety-binding region":
-        return "Lipidation"
-    if annot.featType == "transmembrane region":
-        return "Transmembrane"
-    if annot.shortFeatType == "phos":
-        return "Phosphorylation"
-    if annot.comment == "Nuclear localization signal":
-        return "Nuclear loc"
-    if annot.comment == "Involved in receptor recognition and/or post-binding events":
-        return "Recept recog"
-    if annot.comment == "Fibronectin type-III":
-        return "FibronectIII"
-
-    # more general rules
-    if annot.comment.startswith("Zinc finger protein "):
-        return annot.comment.replace("Zinc finger protein ", "ZF-")
-    if annot.comment.startswith("Necessary for the"):
-        return annot.comment.replace("Necessary for the ", "")
-    if annot.comment.startswith("Interaction with "):
-        return annot.comment.replace("Interaction with ", "Int:")
-    if annot.comment.startswith("Involved in the"):
-        return annot.comment.replace("Involved in the ", "")
-    if annot.comment.startswith("Required for "):
-        return annot.comment.replace("Required for ", "")
-    if annot.comment.startswith("Cleavage; by host "):
-        return "Cleave:" + annot.comment.split()[-1]
-    if annot.comment == "Receptor-binding motif; binding to human ACE2":
-        return "binds ACE2"
+            return featTypeCat[1]
+
+    def getDescName(self, annot):
+        "None if no rule applies"
+        descName = self.featTypeNames.get(annot.featType)
+        if descName is None:
+            descName = self.shortFeatTypeNames.get(annot.shortFeatType)
+        if descName is None:
+            descName = self.commentNames.get(annot.comment)
+        if descName is None:
+            prefixRule = _prefixTrieFind(self.commentPrefixes, annot.comment)
+            if prefixRule is not None:
+                descName = prefixRule.descName
+        if (descName is None) or isinstance(descName, str):
+            return descName
+        return descName(annot)
+
+_annotRulesTbl = AnnotRulesTbl(annotRules, annotPrefixRules)
+
+# mapping of annotations columns to colors
+featTypeColors = _annotRulesTbl.colors["featType"]
+shortFeatTypeColors = _annotRulesTbl.colors["shortFeatType"]
+commentColor = _annotRulesTbl.colors["comment"]
+
+###
+# Color logic.  This mostly matches UniProt genomic track, however colors for
+# overlay are not visible with track colors, so these are adjusted.
+###
+
+# TrEMBL categories to provide special coloring
+_tremblColorCategories = frozenset((
+    UniProtCategory.LocSignal,
+    UniProtCategory.LocExtra,
+    UniProtCategory.LocTransMemb,
+    UniProtCategory.LocCytopl,
+))
 
+def getFeatTypeColor(annot):
+    "by feature or short feature type"
+    color = featTypeColors.get(annot.featType, None)
+    if color is None:
+        color = shortFeatTypeColors.get(annot.shortFeatType, None)
+    return color
+
+def getAnnotColorSwissport(annot):
+    color = commentColor.get(annot.comment, None)
+    if color is None:
+        color = getFeatTypeColor(annot)
+    return color if color is not None else SWISSPCOLOR
+
+def getAnnotColorTrembl(annot):
+    if getAnnotCategory(annot)[0] in _tremblColorCategories:
+        return getAnnotColorSwissport(annot)
+    else:
+        return TREMBLCOLOR
+
+def getAnnotColor(annot, dataSet):
+    if dataSet == UniProtDataSet.SwissProt:
+        return getAnnotColorSwissport(annot)
+    else:
+        return getAnnotColorTrembl(annot)
+
+def getAnnotDescriptiveName(annot):
+    "get name to use in BED, based on doUniprot"
+    name = _annotRulesTbl.getDescName(annot)
+    if name is not None:
+        return name
     # chain annotations
     if annot.longName != "":
         return annot.longName
     if annot.shortName != "":
         return annot.shortName
-
     return annot.shortFeatType
 
 def getAnnotShortDescriptiveName(annot):
@@ -217,39 +369,9 @@ def getAnnotShortDescriptiveName(annot):
         name = name[:14] + "..."
     return name
 
-def getAnnotCategory(annot):  # noqa: C901
+def getAnnotCategory(annot):
     "return a symbolic and description; from uniport trackDb"
-    if annot.featType in ["mutagenesis site", "sequence variant"]:
-        return (UniProtCategory.Mut, "Mutation")
-    elif annot.featType in ["splice variant"]:
-        return (UniProtCategory.Splice, "Splice variant")
-    elif annot.featType in ["strand", "helix", "coiled-coil region", "turn"]:
-        return (UniProtCategory.Struct, "Protein Structure")
-    elif annot.featType in ["transmembrane region"]:
-        # suggested by Regeneron: create four subtracks, for the subcell. localization indicators
-        return (UniProtCategory.LocTransMemb, "Transmembrane Domain")
-    elif annot.comment in ["Extracellular"]:
-        return (UniProtCategory.LocExtra, "Extracellular Domain")
-    elif annot.comment in ["Cytoplasmic"]:
-        return (UniProtCategory.LocCytopl, "Cytoplasmic Domains")
-    elif annot.featType in ["signal peptide"]:
-        return (UniProtCategory.LocSignal, "Signal Peptide")
-    elif annot.featType in ["chain"]:
-        return (UniProtCategory.Chain, "Polypeptide Chains")
-    elif annot.featType in ["repeat"]:
-        return (UniProtCategory.Repeat, "Repeat")
-    elif annot.featType == "sequence conflict":
-        return (UniProtCategory.Conflict, "Sequence Conflict")
-    elif annot.featType in ["disulfide bond"]:
-        return (UniProtCategory.DisulfBond, "Disulfide Bond")
-    elif annot.featType in ["domain", "zinc finger region", "topological domain"]:
-        return (UniProtCategory.Domain, "Domain")
-    elif annot.featType in ["glycosylation site", "phosphorylation site", "modified residue", "lipid moiety-binding region"]:
-        return (UniProtCategory.Modif, "Amino Acid Modification")
-    elif annot.featType in ["region of interest"]:
-        return (UniProtCategory.Interest, "Region of Interest")
-    else:
-        return (UniProtCategory.Other, "Other Annotation")
+    return _annotRulesTbl.getCategory(annot)
 
 def calcTransCategory(uniprotMeta, transId):
     "determine match of transcript to based on what transcripts are listed in metadata"
@@ -328,3 +450,169 @@ class UniprotDecoration(Decoration):
 
     def toRow(self):
         return super().toRow() + encodeRow([getattr(self, f) for f in self.__slots__])
+
+######
+# Creation of decorators from annotation mappings, used by
+# uniprotAnnotsToDecorators and the mapping service.
+######
+
+class DataSetInputs(namedtuple("DataSetInputs",
+                               ("dataSet", "uniprotMetaTsv", "uniprotAnnotsTsv", "annot2GenomePsl", "annot2GenomeRefTsv"))):
+    "input files for one UniProt dataset"
+    pass
+
+class DataSetMappings(namedtuple("DataSetMappings",
+                                 ("dataSetIdx", "transAnnotMappings"))):
+    "TransAnnotMappings tagged with the index of the DataSetInputs they come from"
+    pass
+
+##
+# shortFeatType to not include in track.
+#
+_shortFeatTypesToSkip = frozenset([
+    'splicing',
+])
+def includeAnnot(annot):
+    "filter for desired annotations"
+    return annot.shortFeatType not in _shortFeatTypesToSkip
+
+def makeDecorator(dataSet, transCategory, annotMapping, featStatus, bedBlocks, name, color, fillColor, description, *, glyph=None):
+    annot = annotMapping.annot
+    annotPsl = annotMapping.annotPsl
+    annotType = AnnotType.feature if glyph is None else AnnotType.disruption
+    itemName, itemStart, itemEnd = xrefToItemArgs(annotMapping.annotRef)
+    category, categoryName = getAnnotCategory(annot)
+
+    return UniprotDecoration(annotMapping.annotPsl.tName, bedBlocks, name,
+                             annotPsl.qStrand, color,
+                             itemName, itemStart, itemEnd, glyph, fillColor,
+                             annotType=annotType, dataSet=dataSet,
+                             uniprotAcc=annot.acc, transCategory=transCategory,
+                             canonTransId="", featStatus=featStatus,
+                             category=category, categoryName=categoryName, description=description,
+                             shortFeatType=annot.shortFeatType, featType=annot.featType,
+                             shortName=annot.shortName, longName=annot.longName,
+                             comment=annot.comment, disease=annot.disease)
+
+def makeBlockDeco(dataSet, transCategory, annotMapping, featStatus, bedBlocks, name,
+                  color, fillColor, description):
+    return makeDecorator(dataSet, transCategory, annotMapping, featStatus, bedBlocks, name,
+                         color, fillColor, description)
+
+def makeGlyphDeco(dataSet, transCategory, annotMapping, featStatus, pos, name, color, description):
+    bedBlocks = [BedBlock(pos, pos)]
+    return makeDecorator(dataSet, transCategory, annotMapping, featStatus, bedBlocks, name, color, color, description,
+                         glyph=Glyph.Triangle)
+
+def getDescription(annot):
+    "change this function to get a different description"
+    return getAnnotDescriptiveName(annot)
+
+def mkMainAnnotDecorator(dataSet, transCategory, annotMapping, featIndels):
+    annot = annotMapping.annot
+    description = getDescription(annot)
+    annotColor = getAnnotColor(annot, dataSet)
+    fillColor = annotColor.setAlpha(0.5)
+    featStatus = FeatStatus.complete if len(featIndels) == 0 else FeatStatus.disrupted
+    if len(featIndels) > 0:
+        color = getProblemColor(annot, dataSet)
+    elif transCategory == TransCategory.noncanonical:
+        color = UNIPROT_NONCANON_ISO_OUTLINE_COLOR
+    else:
+        color = UNIPROT_CANON_ISO_OUTLINE_COLOR
+    bedBlocks = [BedBlock(pb.tStart, pb.tEnd) for pb in annotMapping.annotPsl.blocks]
+    return makeBlockDeco(dataSet, transCategory, annotMapping, featStatus, bedBlocks,
+                         annotMapping.annotRef.annotMapId, color, fillColor, description)
+
+def getDistruptId(annotRef, disruptIdx):
+    return f"{annotRef.annotMapId}|{disruptIdx}"
+
+def getIndelDesc(featIndel, annot):
+    indelText = getFeatureIndelText(featIndel.indelType)
+    return f"{indelText} of {featIndel.length} bases in " + getDescription(annot)
+
+def makeFeatDelAnnot(dataSet, transCategory, annotMapping, featIndel, disruptIdx):
+    pos = (featIndel.tStart + featIndel.tEnd) // 2
+    yield makeGlyphDeco(dataSet, transCategory, annotMapping, featIndel.indelType, pos,
+                        getDistruptId(annotMapping.annotRef, disruptIdx), FEAT_DELETION_COLOR,
+                        getIndelDesc(featIndel, annotMapping.annot))
+
+def makeFeatInsAnnot(dataSet, transCategory, annotMapping, featIndel, disruptIdx):
+    color = FEAT_INSERTION_COLOR
+    bedBlocks = [BedBlock(featIndel.tStart, featIndel.tEnd)]
+    yield makeBlockDeco(dataSet, transCategory, annotMapping, featIndel.indelType, bedBlocks,
+                        getDistruptId(annotMapping.annotRef, disruptIdx), color, color,
+                        getIndelDesc(featIndel, annotMapping.annot))
+
+def makeFeatIndelAnnot(dataSet, transCategory, annotMapping, featIndel, disruptIdx):
+    """Make glyphs or block for a particular INDEL in the annotation. A generator
+    so more than one can be returned"""
+    if featIndel.indelType == FeatureIndelType.insert:
+        yield from makeFeatInsAnnot(dataSet, transCategory, annotMapping, featIndel, disruptIdx)
+    else:
+        yield from makeFeatDelAnnot(dataSet, transCategory, annotMapping, featIndel, disruptIdx)
+
+def mkBrokenAnnotDecorators(dataSet, transCategory, annotMapping, featIndels):
+    "produces decorators to mark were annotations are broken in the mappings"
+    decoratorBeds = []
+    disruptIdx = 0
+    for featIndel in featIndels:
+        decoratorBeds.extend(makeFeatIndelAnnot(dataSet, transCategory, annotMapping, featIndel, disruptIdx))
+        disruptIdx += 1
+    return decoratorBeds
+
+def buildAnnotation(dataSet, transCategory, annotMapping, featIndels):
+    "converts BEDs to strings so this work is distributed"
+    decoBeds = []
+    decoBeds.append(mkMainAnnotDecorator(dataSet, transCategory, annotMapping, featIndels))
+    if len(featIndels) > 0:
+        decoBeds.extend(mkBrokenAnnotDecorators(dataSet, transCategory, annotMapping, featIndels))
+    return decoBeds
+
+# only metadata needed for the transcript category and fingerprints
+uniprotMetaDecoratorColumns = ("ensemblTransIds", "ensemblTransAccs")
+
+class AnnotationProcessor:
+    """Class used to generate annotations.  This is used to move most of the
+    processing to the pool sub-process.  Handles one or more datasets, with
+    work passed as DataSetMappings."""
+
+    def __init__(self, dataSetInputs, *, uniprotMetaTbls=None):
+        "uniprotMetaTbls are used if already loaded, otherwise they are loaded from dataSetInputs"
+        self.dataSets = [dsi.dataSet for dsi in dataSetInputs]
+        if uniprotMetaTbls is None:
+            uniprotMetaTbls = [UniProtMetaTbl(dsi.uniprotMetaTsv, columns=uniprotMetaDecoratorColumns) for dsi in dataSetInputs]
+        self.uniprotMetaTbls = uniprotMetaTbls
+
+    def _buildAnnotation(self, dataSetIdx, transAnnotMappings, annotMapping, featIndels):
+        uniprotMeta = self.uniprotMetaTbls[dataSetIdx].getByAcc(annotMapping.annot.acc)
+        transCategory = calcTransCategory(uniprotMeta, transAnnotMappings.transcriptId)
+        return buildAnnotation(self.dataSets[dataSetIdx], transCategory, annotMapping, featIndels)
+
+    def _includeMapping(self, annotMapping):
+        return (annotMapping.annotPsl is not None) and includeAnnot(annotMapping.annot)
+
+    def create(self, dataSetMappings):
+        dataSetIdx, transAnnotMappings = dataSetMappings
+        annotMappings = [am for am in transAnnotMappings.annotMappings
+                         if self._includeMapping(am)]
+        allFeatIndels = analyzeFeatureMappings(transAnnotMappings, annotMappings)
+        beds = []
+        for annotMapping, featIndels in zip(annotMappings, allFeatIndels):
+            beds.extend(self._buildAnnotation(dataSetIdx, transAnnotMappings, annotMapping, featIndels))
+        return beds
+
+def getFeatType(decoBed):
+    """use to return tuple for collecting feature types that used when defining filters"""
+    return (decoBed.category, decoBed.categoryName, decoBed.featType, decoBed.shortFeatType)
+
+def dataSetMappingReader(geneSetData, dataSetInputs):
+    """read the mappings for each dataset in turn, yielding DataSetMappings.  The annotations
+    for a dataset are only loaded once the previous one has been read."""
+    for dataSetIdx, dsi in enumerate(dataSetInputs):
+        uniprotAnnotTbl = UniProtAnnotTbl(dsi.uniprotAnnotsTsv)
+        mappingReader = transAnnotMappingReader(dsi.annot2GenomePsl, dsi.annot2GenomeRefTsv,
+                                                lambda annotId: uniprotAnnotTbl.getByAnnotId(annotId),
+                                                lambda transId, chrom: geneSetData.getAlign(transId, chrom))
+        for transAnnotMappings in mappingReader:
+            yield DataSetMappings(dataSetIdx, transAnnotMappings)
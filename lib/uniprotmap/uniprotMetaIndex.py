@@ -0,0 +1,134 @@
+"""
+Index of UniProt metadata files (swissprot.9606.tab, trembl.9606.tab) for
+fetching records without parsing the whole file.  The index is an SQLite
+database of keys to the byte offsets of records.  It records the size and
+modification time of the metadata file and is rebuilt when they change.
+"""
+import os
+import sqlite3
+from pycbio.sys.symEnum import SymEnum, auto
+from pycbio.sys import fileOps
+from uniprotmap.uniprot import UniProtError, UniProtMeta, splitMetaList, splitDropVersion
+
+class UniProtMetaKey(SymEnum):
+    "keys that the metadata is indexed by"
+    acc = auto()
+    mainIsoAcc = auto()
+    geneName = auto()
+    ensemblTransAcc = auto()
+
+_gzipMagic = b'\x1f\x8b'
+
+# increment when the schema or keys change
+_indexVersion = 1
+
+def uniprotMetaIndexDefault(uniprotMetaTsv):
+    "default index file name for a metadata file"
+    return uniprotMetaTsv + ".idx.sqlite"
+
+def _metaFileStamp(uniprotMetaTsv):
+    st = os.stat(uniprotMetaTsv)
+    return f"{_indexVersion}:{st.st_size}:{st.st_mtime_ns}"
+
+def _parseHeader(line):
+    return line.decode().rstrip('\n').split('\t')
+
+def _recordKeys(columnMap, row):
+    yield UniProtMetaKey.acc, row[columnMap["acc"]]
+    yield UniProtMetaKey.mainIsoAcc, row[columnMap["mainIsoAcc"]]
+    for geneName in splitMetaList(row[columnMap["geneName"]]):
+        yield UniProtMetaKey.geneName, geneName
+    for transAcc in splitDropVersion(row[columnMap["ensemblTrans"]]):
+        yield UniProtMetaKey.ensemblTransAcc, transAcc
+
+def _indexRecords(fh):
+    "generate (keyType, key, offset) for each record"
+    columns = _parseHeader(fh.readline())
+    columnMap = {col: i for i, col in enumerate(columns)}
+    offset = fh.tell()
+    for line in iter(fh.readline, b''):
+        row = line.decode().rstrip('\n').split('\t')
+        for keyType, key in _recordKeys(columnMap, row):
+            yield str(keyType), key, offset
+        offset += len(line)
+
+def _checkUncompressed(uniprotMetaTsv, fh):
+    if fh.peek(2)[0:2] == _gzipMagic:
+        raise UniProtError(f"can't index compressed UniProt metadata file: {uniprotMetaTsv}")
+
+def uniprotMetaIndexBuild(uniprotMetaTsv, indexDb):
+    """build an index of an uncompressed UniProt metadata file"""
+    with fileOps.AtomicFileCreate(indexDb) as tmpIndexDb:
+        conn = sqlite3.connect(tmpIndexDb)
+        try:
+            conn.execute("CREATE TABLE info (stamp TEXT)")
+            conn.execute("CREATE TABLE keys (keyType TEXT, key TEXT, offset INTEGER)")
+            with open(uniprotMetaTsv, 'rb') as fh:
+                _checkUncompressed(uniprotMetaTsv, fh)
+                conn.executemany("INSERT INTO keys VALUES (?, ?, ?)", _indexRecords(fh))
+            conn.execute("CREATE INDEX keysIdx ON keys (keyType, key)")
+            conn.execute("INSERT INTO info VALUES (?)", (_metaFileStamp(uniprotMetaTsv),))
+            conn.commit()
+        finally:
+            conn.close()
+
+def _indexCurrent(uniprotMetaTsv, indexDb):
+    if not os.path.exists(indexDb):
+        return False
+    conn = sqlite3.connect(indexDb)
+    try:
+        stamp = conn.execute("SELECT stamp FROM info").fetchone()
+    except sqlite3.DatabaseError:
+        return False
+    finally:
+        conn.close()
+    return (stamp is not None) and (stamp[0] == _metaFileStamp(uniprotMetaTsv))
+
+class UniProtMetaIndex:
+    """Fetch UniProtMeta records using an index.  The index is built if it
+    doesn't exist or is out of date with the metadata file.  Records have all
+    columns and are created for each query."""
+    def __init__(self, uniprotMetaTsv, indexDb=None):
+        if indexDb is None:
+            indexDb = uniprotMetaIndexDefault(uniprotMetaTsv)
+        if not _indexCurrent(uniprotMetaTsv, indexDb):
+            uniprotMetaIndexBuild(uniprotMetaTsv, indexDb)
+        self.conn = sqlite3.connect(indexDb)
+        self.fh = open(uniprotMetaTsv, 'rb')
+        self.columns = _parseHeader(self.fh.readline())
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _readRecord(self, offset):
+        self.fh.seek(offset)
+        row = self.fh.readline().decode().rstrip('\n').split('\t')
+        return UniProtMeta(**dict(zip(self.columns, row)))
+
+    def getOffsets(self, keyType, key):
+        "list of record offsets for a key, in file order"
+        return [r[0] for r in self.conn.execute("SELECT offset FROM keys WHERE keyType = ? AND key = ? ORDER BY offset",
+                                                (str(keyType), key))]
+
+    def query(self, keyType, keys):
+        """Return records matching a sequence of keys of keyType, in the order
+        of the keys.  A record is only returned once."""
+        seen = set()
+        recs = []
+        for key in keys:
+            for offset in self.getOffsets(keyType, key):
+                if offset not in seen:
+                    seen.add(offset)
+                    recs.append(self._readRecord(offset))
+        return recs
@@ -1,9 +1,10 @@
 """
 Compare mapped UniProt annotations to interpro annotations.
 """
+from collections import defaultdict
 from pycbio.sys.symEnum import SymEnum, auto
 from uniprotmap.annotMappings import TransAnnotMappings
-from uniprotmap.mappingAnalysis import analyzeFeatureMapping
+from uniprotmap.mappingAnalysis import analyzeFeatureMappings, pslTSimilarity
 
 class AnnotMethod(SymEnum):
     """how was annotation being compared produced?"""
@@ -69,77 +70,112 @@ class TransAnnotDiffs(list):
         for ad in self:
             ad.dump(fh, self.transPsl.qName, indent=-indent + 1)
 
-def _makeSrcAnnotDiff(transAnnotMappings, annotMapping):
+def _makeSrcAnnotDiff(annotMapping, featureIndels):
     """prevMappedTEnd & nextMappedTStart are use to fill in coords for region"""
-    featureIndels = analyzeFeatureMapping(transAnnotMappings, annotMapping)
     diff = AnnotDiff(annotMapping.coords)
     diff.srcAnnot = annotMapping
     diff.srcFeatureIndels = featureIndels
     return diff
 
-def _buildSrcDiffs(transAnnotDiffs, srcTransAnnotMappings):
-    "must runs before adding target annots"
-    for iAnnot, annotMapping in enumerate(srcTransAnnotMappings.annotMappings):
-        transAnnotDiffs.append(_makeSrcAnnotDiff(srcTransAnnotMappings, annotMapping))
-
-def _findTargetDiffIdx(transAnnotDiffs, annotMapping, iDiffs):
-    """find point of first overlap with a source in diffs lists, or entryr before if no overlap """
-    # FIXME: for now, start over.  For multiple overlaps, this was going past the overlap point.
-    # and creating new entries.
-    iDiffs = 0
-    while iDiffs < len(transAnnotDiffs):
-        if annotMapping.coords.start < transAnnotDiffs[iDiffs].coords.end:
-            if transAnnotDiffs[iDiffs].srcAnnot is not None:
-                return iDiffs
-        iDiffs += 1
-    return iDiffs  # add to end
+def _buildSrcDiffs(srcTransAnnotMappings):
+    "build the list of source diffs, in the order of the source annotations"
+    allFeatureIndels = analyzeFeatureMappings(srcTransAnnotMappings)
+    return [_makeSrcAnnotDiff(annotMapping, featureIndels)
+            for annotMapping, featureIndels in zip(srcTransAnnotMappings.annotMappings, allFeatureIndels)]
 
 def _targetDiffNew(annotMapping):
     diff = AnnotDiff(annotMapping.coords)
     diff.targetAnnots.append(annotMapping)
     return diff
 
-def _addTargetDiffOverlap(transAnnotDiffs, annotMapping, iDiffs):
-    # stop when find a mapped, non-overlapping. Unmapped are skipped
-    while iDiffs < len(transAnnotDiffs):
-        if transAnnotDiffs[iDiffs].coords is not None:
-            if annotMapping.coords.overlaps(transAnnotDiffs[iDiffs].coords):
-                assert transAnnotDiffs[iDiffs].srcAnnot is not None
-                transAnnotDiffs[iDiffs].targetAnnots.append(annotMapping)
-            else:
+def _targetSweepOrder(annotMappings):
+    """list of (inputIdx, annotMapping) ordered by start, with unmapped last"""
+    def _startKey(entry):
+        coords = entry[1].coords
+        return (1, 0) if coords is None else (0, coords.start)
+    return sorted(enumerate(annotMappings), key=_startKey)
+
+class _TargetDiffSweep:
+    """Sweep of target annotations, in start order, over the mapped source
+    diffs, in start order.  A target is added to all source diffs it overlaps.
+    Ones that don't overlap a source become new diffs, inserted before the next
+    source diff or appended at the end.
+
+    As targets starts don't decrease, the first source diff ending after the
+    target start never moves backwards, so each is passed over only once.
+    Targets are kept with their input index so the results are in input order.
+    """
+    def __init__(self, srcDiffs):
+        self.srcDiffs = srcDiffs
+        self.mappedIdxs = sorted([i for i, d in enumerate(srcDiffs) if d.coords is not None],
+                                 key=lambda i: srcDiffs[i].coords.start)
+        self.iNext = 0  # in mappedIdxs
+        # these are by srcDiffs index and contain (inputIdx, annotMapping)
+        self.overlapping = defaultdict(list)
+        self.insertsBefore = defaultdict(list)
+        self.appended = []
+
+    def _addOverlaps(self, inputIdx, annotMapping):
+        overlapped = False
+        for iMapped in range(self.iNext, len(self.mappedIdxs)):
+            iDiff = self.mappedIdxs[iMapped]
+            srcCoords = self.srcDiffs[iDiff].coords
+            if srcCoords.start >= annotMapping.coords.end:
                 break  # no more overlaps
-        iDiffs += 1
-
-def _addTargetDiff(transAnnotDiffs, annotMapping, iDiffs):
-    iDiffs = _findTargetDiffIdx(transAnnotDiffs, annotMapping, iDiffs)
-    if iDiffs >= len(transAnnotDiffs):
-        transAnnotDiffs.targetAnnots.append(_targetDiffNew(annotMapping))
-    elif not annotMapping.coords.overlaps(transAnnotDiffs[iDiffs].coords):
-        transAnnotDiffs.insert(iDiffs, _targetDiffNew(annotMapping))
-    else:
-        _addTargetDiffOverlap(transAnnotDiffs, annotMapping, iDiffs)
-    return iDiffs
-
-def _addTargetDiffs(transAnnotDiffs, targetTransAnnotMappings):
-    "add in the target (interpro) annotations"
-    iDiffs = 0  # point to start search for overlap or insert
-    for annotMapping in targetTransAnnotMappings.annotMappings:
-        iDiffs = _addTargetDiff(transAnnotDiffs, annotMapping, iDiffs)
+            if srcCoords.overlaps(annotMapping.coords):
+                self.overlapping[iDiff].append((inputIdx, annotMapping))
+                overlapped = True
+        return overlapped
+
+    def _addNew(self, inputIdx, annotMapping):
+        if self.iNext < len(self.mappedIdxs):
+            self.insertsBefore[self.mappedIdxs[self.iNext]].append((inputIdx, annotMapping))
+        else:
+            self.appended.append((inputIdx, annotMapping))
+
+    def add(self, inputIdx, annotMapping):
+        coords = annotMapping.coords
+        if coords is None:
+            self.appended.append((inputIdx, annotMapping))
+            return
+        while ((self.iNext < len(self.mappedIdxs)) and
+               (self.srcDiffs[self.mappedIdxs[self.iNext]].coords.end <= coords.start)):
+            self.iNext += 1
+        if not self._addOverlaps(inputIdx, annotMapping):
+            self._addNew(inputIdx, annotMapping)
+
+    def finish(self, transAnnotDiffs):
+        "add the source and new target diffs to transAnnotDiffs"
+        for iDiff, srcDiff in enumerate(self.srcDiffs):
+            transAnnotDiffs.extend([_targetDiffNew(am) for _, am in sorted(self.insertsBefore.get(iDiff, ()))])
+            srcDiff.targetAnnots.extend([am for _, am in sorted(self.overlapping.get(iDiff, ()))])
+            transAnnotDiffs.append(srcDiff)
+        transAnnotDiffs.extend([_targetDiffNew(am) for _, am in sorted(self.appended)])
 
 def compareTransAnnotations(srcTransAnnotMappings: TransAnnotMappings,
                             targetTransAnnotMappings: TransAnnotMappings) -> TransAnnotDiffs:
-    """build comparison of src to target domain annotations.  Inputs must be sorted"""
+    """build comparison of src to target domain annotations.  Annotations are
+    compared in genomic order, which is normally that of the inputs."""
     transAnnotDiffs = TransAnnotDiffs(srcTransAnnotMappings.transPsl)
-    _buildSrcDiffs(transAnnotDiffs, srcTransAnnotMappings)
-    # FIXME: tmp debug for insertion point
-    if False:
-        print(64 * '=')
-        print(srcTransAnnotMappings.transcriptId)
-        for d in transAnnotDiffs:
-            print(d.short())
-    _addTargetDiffs(transAnnotDiffs, targetTransAnnotMappings)
+    sweep = _TargetDiffSweep(_buildSrcDiffs(srcTransAnnotMappings))
+    for inputIdx, annotMapping in _targetSweepOrder(targetTransAnnotMappings.annotMappings):
+        sweep.add(inputIdx, annotMapping)
+    sweep.finish(transAnnotDiffs)
     if False:
         print(64 * "-")
         for d in transAnnotDiffs:
             print(d.short())
     return transAnnotDiffs
+
+def calcTargetSimilarities(transAnnotDiffs):
+    """Compute the similarity of target annotations to the source annotation
+    they overlap for all diffs of a transcript.  Only these pairs are scored.
+    Returns a dict keyed by (srcAnnotMapId, targetAnnotMapId)."""
+    targetSims = {}
+    for annotDiff in transAnnotDiffs:
+        if annotDiff.srcAnnot is not None:
+            srcAnnot = annotDiff.srcAnnot
+            for targetAnnot in annotDiff.targetAnnots:
+                targetSims[(srcAnnot.annotRef.annotMapId, targetAnnot.annotRef.annotMapId)] = \
+                    pslTSimilarity(srcAnnot.annotPsl, targetAnnot.annotPsl)
+    return targetSims
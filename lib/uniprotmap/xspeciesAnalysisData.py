@@ -8,7 +8,7 @@ from pycbio.tsv import TsvReader, strOrNoneType
 from uniprotmap import DataError
 from uniprotmap.uniprot import UniProtAnnotTbl
 from uniprotmap.interproscan import InterproAnnotTbl, interproAnnotsLoad
-from uniprotmap.annotMappings import AnnotMappingsTbl, transAnnotMappingLoader
+from uniprotmap.annotMappings import AnnotMappingsTbl, transAnnotMappingLoader, transAnnotMappingReader
 
 class AnnotAssoc(namedtuple("AnnotAssoc",
                             ("uniprotShortFeatType", "uniprotComment",
@@ -95,20 +95,26 @@ class SrcAnnotSet:
     uniprotAnnotTbl: UniProtAnnotTbl
     annotMappingsTbl: AnnotMappingsTbl
 
-def srcAnnotSetLoad(uniprotAnnotTsv, uniprotAnnot2GenomePsl, uniprotAnnot2GenomeRefTsv,
-                    annotAssocs, targetGeneSet):
+def _makeUniprotLookup(uniprotAnnotTbl, annotAssocs):
     def uniprotLookup(annotId):
         "None if annotation should be skipped"
         annot = uniprotAnnotTbl.getByAnnotId(annotId)
         return annot if annotAssocs.useSrc(annot.shortFeatType, annot.comment) else None
+    return uniprotLookup
 
+def srcAnnotSetLoad(uniprotAnnotTsv, uniprotAnnot2GenomePsl, uniprotAnnot2GenomeRefTsv,
+                    annotAssocs, targetGeneSet, *, loadMappings=True):
+    """If loadMappings is False, annotMappingsTbl is None and only the
+    annotations are loaded, as used when streaming mappings."""
     try:
         uniprotAnnotTbl = UniProtAnnotTbl(uniprotAnnotTsv)
-        annotMappingsTbl = transAnnotMappingLoader(uniprotAnnot2GenomePsl,
-                                                   uniprotAnnot2GenomeRefTsv,
-                                                   uniprotLookup,
-                                                   targetGeneSet.data.getAlign)
-        _checkForOverlapAnnots(annotMappingsTbl)
+        annotMappingsTbl = None
+        if loadMappings:
+            annotMappingsTbl = transAnnotMappingLoader(uniprotAnnot2GenomePsl,
+                                                       uniprotAnnot2GenomeRefTsv,
+                                                       _makeUniprotLookup(uniprotAnnotTbl, annotAssocs),
+                                                       targetGeneSet.data.getAlign)
+            _checkForOverlapAnnots(annotMappingsTbl)
         return SrcAnnotSet(uniprotAnnotTbl, annotMappingsTbl)
     except Exception as ex:
         raise DataError("problem load mapped source annotations from `" +
@@ -122,21 +128,81 @@ class TargetAnnotSet:
     interproAnnotTbl: InterproAnnotTbl
     annotMappingsTbl: AnnotMappingsTbl
 
-def targetAnnotSetLoad(interproAnnotTsv, interproAnnot2GenomePsl, interproAnnot2GenomeRefTsv,
-                       annotAssocs, targetGeneSet):
+def _makeInterproLookup(interproAnnotTbl, annotAssocs):
     def interproLookup(annotId):
         "None if annotation should be skipped"
         annot = interproAnnotTbl.getByAnnotId(annotId)
         return annot if annotAssocs.useTarget(annot.analysis, annot.interpro_accession) else None
+    return interproLookup
+
+def targetAnnotSetLoad(interproAnnotTsv, interproAnnot2GenomePsl, interproAnnot2GenomeRefTsv,
+                       annotAssocs, targetGeneSet, *, loadMappings=True):
+    """If loadMappings is False, annotMappingsTbl is None and only the
+    annotations are loaded, as used when streaming mappings."""
     try:
         interproAnnotTbl = interproAnnotsLoad(interproAnnotTsv)
-        annotMappingsTbl = transAnnotMappingLoader(interproAnnot2GenomePsl,
-                                                   interproAnnot2GenomeRefTsv,
-                                                   interproLookup, targetGeneSet.data.getAlign,
-                                                   inTranscriptionOrder=True)
+        annotMappingsTbl = None
+        if loadMappings:
+            annotMappingsTbl = transAnnotMappingLoader(interproAnnot2GenomePsl,
+                                                       interproAnnot2GenomeRefTsv,
+                                                       _makeInterproLookup(interproAnnotTbl, annotAssocs),
+                                                       targetGeneSet.data.getAlign,
+                                                       inTranscriptionOrder=True)
         return TargetAnnotSet(interproAnnotTbl, annotMappingsTbl)
     except Exception as ex:
         raise DataError("problem load target annotations from `" +
                         interproAnnotTsv + "', `" +
                         interproAnnot2GenomePsl + "', and `" +
                         interproAnnot2GenomeRefTsv + "'") from ex
+
+###
+# Streaming of mappings.  Both mapping files must be grouped by transcript and
+# sorted by (transcriptId, chrom).  Memory used is bounded by the largest
+# transcript rather than the whole set.
+###
+def srcAnnotMappingReader(srcAnnotSet, uniprotAnnot2GenomePsl, uniprotAnnot2GenomeRefTsv,
+                          annotAssocs, targetGeneSet):
+    "stream source TransAnnotMappings, checking each for overlapping annotations"
+    for transAnnotMappings in transAnnotMappingReader(uniprotAnnot2GenomePsl, uniprotAnnot2GenomeRefTsv,
+                                                      _makeUniprotLookup(srcAnnotSet.uniprotAnnotTbl, annotAssocs),
+                                                      targetGeneSet.data.getAlign, indexPsls=True):
+        _checkForOverlapTransAnnots(transAnnotMappings)
+        yield transAnnotMappings
+
+def targetAnnotMappingReader(targetAnnotSet, interproAnnot2GenomePsl, interproAnnot2GenomeRefTsv,
+                             annotAssocs, targetGeneSet):
+    "stream target TransAnnotMappings"
+    yield from transAnnotMappingReader(interproAnnot2GenomePsl, interproAnnot2GenomeRefTsv,
+                                       _makeInterproLookup(targetAnnotSet.interproAnnotTbl, annotAssocs),
+                                       targetGeneSet.data.getAlign, inTranscriptionOrder=True, indexPsls=True)
+
+def _sortedTransAnnotMappings(transAnnotMappingsIter, desc):
+    "yield ((transcriptId, chrom), transAnnotMappings), checking order"
+    prevKey = None
+    for transAnnotMappings in transAnnotMappingsIter:
+        key = (transAnnotMappings.transcriptId, transAnnotMappings.chrom)
+        if (prevKey is not None) and (key <= prevKey):
+            raise DataError(f"{desc} mappings are not sorted by transcript and chrom: {prevKey} is followed by {key}")
+        yield key, transAnnotMappings
+        prevKey = key
+
+def annotMappingsJoin(srcTransAnnotMappingsIter, targetTransAnnotMappingsIter):
+    """Merge-join source and target TransAnnotMappings streams sorted by
+    (transcriptId, chrom).  Yields ((transcriptId, chrom), srcTransAnnotMappings,
+    targetTransAnnotMappings), with None for a transcript not in one of the
+    streams.  This is the same order as AnnotMappingsTbl analysis."""
+    srcIter = _sortedTransAnnotMappings(srcTransAnnotMappingsIter, "source")
+    targetIter = _sortedTransAnnotMappings(targetTransAnnotMappingsIter, "target")
+    src = next(srcIter, None)
+    target = next(targetIter, None)
+    while (src is not None) or (target is not None):
+        if (target is None) or ((src is not None) and (src[0] < target[0])):
+            yield src[0], src[1], None
+            src = next(srcIter, None)
+        elif (src is None) or (target[0] < src[0]):
+            yield target[0], None, target[1]
+            target = next(targetIter, None)
+        else:
+            yield src[0], src[1], target[1]
+            src = next(srcIter, None)
+            target = next(targetIter, None)